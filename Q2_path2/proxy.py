@@ -1,26 +1,88 @@
 #路徑 rapi@raspberrypi:~/NetLatencyLossEvaluator/Q2_path2/proxy.py
 import socket
+import threading
 import time
 import random
+import heapq
+import itertools
+
+MAX_DELAYED_PACKETS = 10000
+DELAY_SECONDS = 0.5  # 延遲 500 毫秒
+
+class DelayScheduler:
+    """延遲封包排程器: 以 heap 依釋放時間排序, 由單一執行緒在到期時送出, 取代每個延遲封包一個執行緒"""
+    def __init__(self, max_pending=MAX_DELAYED_PACKETS):
+        self.heap = []  # (release time, order, data, address, socket, callback)
+        self.order = itertools.count()  # 相同釋放時間時維持先進先出
+        self.cond = threading.Condition()
+        self.max_pending = max_pending
+        self.sending = 0  # 已到期、正在送出的封包數
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def schedule(self, delay, data, address, sock, callback=None):
+        """在 delay 秒後送出封包; 佇列已滿時回傳 False, 由呼叫者視為丟包"""
+        with self.cond:
+            if len(self.heap) >= self.max_pending:
+                return False
+            entry = (time.monotonic() + delay, next(self.order), data, address, sock, callback)
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry:
+                # 新封包比原本最早的還早到期, 喚醒執行緒重新計算等待時間
+                self.cond.notify()
+        return True
+
+    def pending(self):
+        with self.cond:
+            return len(self.heap) + self.sending
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.heap:
+                    self.cond.wait()
+                now = time.monotonic()
+                if self.heap[0][0] > now:
+                    self.cond.wait(self.heap[0][0] - now)
+                    continue
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    due.append(heapq.heappop(self.heap))
+                self.sending = len(due)
+            for _, _, data, address, sock, callback in due:
+                try:
+                    sock.sendto(data, address)
+                    if callback is not None:
+                        callback(data)
+                except OSError as e:
+                    print(f"Delayed send failed: {e}")
+            with self.cond:
+                self.sending = 0
+
 
 def udp_proxy2():
     proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     proxy_socket.bind(('0.0.0.0', 5408))  #設定proxy ip為0.0.0.0 讓proxy能夠監聽所有在port5408的ip(Q2 path2)
     client_address = ('192.168.88.12', 5407)  #已設定為轉發實際client ip和port(Q2 path2)
+    delay_scheduler = DelayScheduler()
     print("Proxy2 ready to forward packets from server to client")
 
     # 處理 10 個封包
     for i in range(10):
         data, _ = proxy_socket.recvfrom(1024)
 
-        # 加入 5% 的機率延遲
+        # 加入 5% 的機率延遲, 交給排程器送出, 不阻塞後面的封包
         if random.random() < 0.05:
             print(f"Delaying packet {i+1} by 500 ms")
-            time.sleep(0.5)  # 延遲 500 毫秒
+            delay_scheduler.schedule(DELAY_SECONDS, data, client_address, proxy_socket,
+                                     lambda data: print(f"Forwarded: {data.decode()}"))
+            continue
 
         proxy_socket.sendto(data, client_address)
         print(f"Forwarded: {data.decode()}")
 
+    # 等待延遲中的封包送出後再關閉 socket
+    while delay_scheduler.pending():
+        time.sleep(0.05)
     proxy_socket.close()
     print("Proxy2 finished forwarding packets.")
 
@@ -2,10 +2,62 @@ import socket
 import threading
 import time
 import random
+import heapq
+import itertools
 
-def delay_packet(data, client_address, proxy_socket):
-    time.sleep(0.5)
-    proxy_socket.sendto(data, client_address)
+MAX_DELAYED_PACKETS = 10000
+DELAY_SECONDS = 0.5
+
+class DelayScheduler:
+    """延遲封包排程器: 以 heap 依釋放時間排序, 由單一執行緒在到期時送出, 取代每個延遲封包一個執行緒"""
+    def __init__(self, max_pending=MAX_DELAYED_PACKETS):
+        self.heap = []  # (release time, order, data, address, socket, callback)
+        self.order = itertools.count()  # 相同釋放時間時維持先進先出
+        self.cond = threading.Condition()
+        self.max_pending = max_pending
+        self.sending = 0  # 已到期、正在送出的封包數
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def schedule(self, delay, data, address, sock, callback=None):
+        """在 delay 秒後送出封包; 佇列已滿時回傳 False, 由呼叫者視為丟包"""
+        with self.cond:
+            if len(self.heap) >= self.max_pending:
+                return False
+            entry = (time.monotonic() + delay, next(self.order), data, address, sock, callback)
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry:
+                # 新封包比原本最早的還早到期, 喚醒執行緒重新計算等待時間
+                self.cond.notify()
+        return True
+
+    def pending(self):
+        with self.cond:
+            return len(self.heap) + self.sending
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.heap:
+                    self.cond.wait()
+                now = time.monotonic()
+                if self.heap[0][0] > now:
+                    self.cond.wait(self.heap[0][0] - now)
+                    continue
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    due.append(heapq.heappop(self.heap))
+                self.sending = len(due)
+            for _, _, data, address, sock, callback in due:
+                try:
+                    sock.sendto(data, address)
+                    if callback is not None:
+                        callback(data)
+                except OSError as e:
+                    print(f"Delayed send failed: {e}")
+            with self.cond:
+                self.sending = 0
+
+def log_delayed_forward(data):
     print(f"Forwarded after delay: {data.decode()}")
 
 def udp_proxy2_delay():
@@ -13,13 +65,16 @@ def udp_proxy2_delay():
     proxy_socket.bind(('192.168.88.111', 5408))
 
     client_address = ('192.168.88.12', 5407)
+    delay_scheduler = DelayScheduler()
     print("Proxy2 with 5% delay")
 
     while True:
         data, _ = proxy_socket.recvfrom(1024)
         if random.random() < 0.05:  # 5% chance to delay
-            threading.Thread(target=delay_packet, args=(data, client_address, proxy_socket)).start()
-            print(f"Packet delayed: {data.decode()}")
+            if delay_scheduler.schedule(DELAY_SECONDS, data, client_address, proxy_socket, log_delayed_forward):
+                print(f"Packet delayed: {data.decode()}")
+            else:
+                print(f"Delay queue full, packet dropped: {data.decode()}")
         else:
             proxy_socket.sendto(data, client_address)
             print(f"Forwarded immediately: {data.decode()}")
@@ -1,13 +1,170 @@
 import socket
 import select
-import lzma
-from collections import defaultdict
-from flask import Flask, render_template, jsonify
+import asyncio
+from collections import defaultdict, OrderedDict
+from flask import Flask, Response, render_template, request
 import threading
 import time
+import json
+import codecs
+import zlib
+from protocol import (DATA_HEADER, HEADER_VERSION, FLAG_LAST, FLAG_PARITY, FLAG_RETRANSMIT, FLAG_CRC, CODECS,
+                      DECOMPRESS_ERRORS, parse_header, parse_parity, recover_chunk, encode_sack)
+
+# Largest UDP payload, size of the reusable receive buffer
+MAX_DATAGRAM = 65535
+# Receive engine of the client below: 'select' or 'asyncio'
+CLIENT_ENGINE = 'select'
+# Pre-encoded /packets pages kept for the current data
+PACKETS_CACHE_ENTRIES = 16
+# Seconds without a datagram after which an incomplete session is dropped
+SESSION_IDLE_TIMEOUT = 30.0
+# Finished sessions remembered, so their late retransmissions are acknowledged instead of starting a new transfer
+FINISHED_SESSIONS = 64
+# Cleared reassembly buffers kept for the next transfers, so their allocation is reused
+FREE_BUFFERS = 4
+
+class ReassemblyBuffer:
+    """Received chunks written straight into one bytearray at sequence * chunk_size.
+    Every chunk but the last has the same size, learned from the first full chunk received"""
+    def __init__(self, initial_size=1 << 20):
+        self.data = bytearray(initial_size)
+        self.chunk_size = None
+        self.lengths = {}  # sequence -> stored length, only the last chunk is shorter
+        self.pending = {}  # Last chunk received before chunk_size was known
+
+    def __contains__(self, sequence: int) -> bool:
+        return sequence in self.lengths or sequence in self.pending
+
+    def __len__(self) -> int:
+        return len(self.lengths) + len(self.pending)
+
+    def reserve(self, size: int):
+        """Grow the backing bytearray to at least size bytes; no view of it may be alive"""
+        if size > len(self.data):
+            self.data.extend(bytes(max(size, 2 * len(self.data)) - len(self.data)))
+
+    def reserve_sequences(self, total_sequences: int):
+        if self.chunk_size is not None:
+            self.reserve(total_sequences * self.chunk_size)
+
+    def put(self, sequence: int, payload, is_last: bool = False):
+        if self.chunk_size is None:
+            if is_last:
+                # Only the last chunk may be short, so it cannot tell the chunk size
+                self.pending[sequence] = bytes(payload)
+                return
+            self.chunk_size = len(payload)
+            pending, self.pending = self.pending, {}
+            for pending_sequence, pending_payload in pending.items():
+                self.put(pending_sequence, pending_payload, True)
+        if len(payload) > self.chunk_size or (len(payload) < self.chunk_size and not is_last):
+            raise ValueError(f"chunk {sequence} is {len(payload)} bytes, expected {self.chunk_size}")
+        offset = sequence * self.chunk_size
+        self.reserve(offset + len(payload))
+        self.data[offset:offset + len(payload)] = payload
+        self.lengths[sequence] = len(payload)
+
+    def view(self, sequence: int) -> memoryview:
+        """Read-only view of a stored chunk, release it before the next put()"""
+        if sequence in self.pending:
+            return memoryview(self.pending[sequence])
+        offset = sequence * self.chunk_size
+        return memoryview(self.data)[offset:offset + self.lengths[sequence]].toreadonly()
+
+    def clear(self):
+        """Forget the chunks but keep the allocation, UDPClient hands it to the next transfer"""
+        self.chunk_size = None
+        self.lengths.clear()
+        self.pending.clear()
+
+class Transfer:
+    """Reassembly, incremental decompression and ACK state of one transfer session"""
+    def __init__(self, session_id: int, buffer: ReassemblyBuffer = None):
+        self.session_id = session_id
+        self.last_activity = time.time()
+        self.buffer = buffer if buffer is not None else ReassemblyBuffer()
+        self.received_sequences = set()
+        self.total_expected_sequences = None  # Track total expected sequences
+        self.codec_id = None  # Codec of the transfer, from the packet header
+        self.parity_blocks = {}  # first sequence of block -> (count, length_xor, parity)
+        self.parity_index = {}  # sequence -> first sequence of its parity block
+        self.next_feed_sequence = 0  # Next sequence to hand to the decompressor
+        self.decompressor = None
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.decoded_parts = []  # Text decompressed so far, in order
+        # asyncio engine: chunk copies waiting for the decompression job, guarded by feed_lock
+        self.feed_lock = threading.Lock()
+        self.feed_queue = []
+        self.feed_running = False  # A decompression job of this transfer is queued or running
+        self.finishing = False  # All chunks are queued, the job finishes the transfer once the queue is empty
+        self.feed_error = None  # First decompression error of the job, raised by finish()
+        # Selective ACK state, guarded by UDPClient.ack_lock
+        self.cumulative_ack = 0  # Every sequence below this was received
+        self.out_of_order = set()  # Received sequences above cumulative_ack
+        self.pending_acks = 0  # Packets received since the last SACK
+
+    def feed_contiguous(self):
+        """Decompress the contiguous prefix of received chunks, so decompression overlaps the transfer"""
+        if self.codec_id is None:
+            return
+        while self.next_feed_sequence in self.buffer:
+            with self.buffer.view(self.next_feed_sequence) as chunk:
+                self.decompress(chunk)
+            self.next_feed_sequence += 1
+
+    def take_contiguous(self) -> list:
+        """Copies of the chunks that became contiguous since the last call, for decompression on another thread.
+        Copies, because the next put() may grow the buffer under a view"""
+        chunks = []
+        if self.codec_id is None:
+            return chunks
+        while self.next_feed_sequence in self.buffer:
+            with self.buffer.view(self.next_feed_sequence) as chunk:
+                chunks.append(bytes(chunk))
+            self.next_feed_sequence += 1
+        return chunks
+
+    def decompress(self, chunk):
+        if self.decompressor is None:
+            self.decompressor = CODECS[self.codec_id].decompressor()
+        self.decoded_parts.append(self.text_decoder.decode(self.decompressor.decompress(chunk)))
+
+    def is_complete(self) -> bool:
+        if self.total_expected_sequences is None:
+            return False
+        return self.total_expected_sequences == len(self.received_sequences)
+
+    def finish(self) -> str:
+        """Decompress whatever has not been fed yet, flush the decompressor and return the text"""
+        if self.feed_error is not None:
+            raise self.feed_error
+        self.feed_contiguous()
+        if self.decompressor is None:
+            raise ValueError(f"codec of session {self.session_id} is unknown")
+        flush = getattr(self.decompressor, 'flush', None)
+        if flush is not None:
+            self.decoded_parts.append(self.text_decoder.decode(flush()))
+        # Incremental decompressors return what they have instead of failing on a truncated stream
+        if not getattr(self.decompressor, 'eof', True):
+            raise EOFError("Compressed data ended before the end-of-stream marker was reached")
+        self.decoded_parts.append(self.text_decoder.decode(b"", final=True))
+        return "".join(self.decoded_parts)
+
+class DatagramEndpoint(asyncio.DatagramProtocol):
+    """asyncio endpoint of one path port, hands every datagram to the client"""
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client.on_datagram(data)
+
+    def error_received(self, exc):
+        print(f"Error receiving packet: {exc}")
 
 class UDPClient:
-    def __init__(self, ports=[5405, 5407], client_ip='192.168.88.12', server_ip='192.168.88.21', server_port=5409):
+    def __init__(self, ports=[5405, 5407], client_ip='192.168.88.12', server_ip='192.168.88.21', server_port=5409,
+                 ack_every=8, ack_interval=0.01, engine='select'):
         # Initialize receive sockets
         self.receive_sockets = []
         for port in ports:
@@ -19,90 +176,361 @@ class UDPClient:
         self.ack_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.server_address = (server_ip, server_port)
         
-        # Buffer for received packets
-        self.buffer = {}
-        self.received_sequences = set()
-        self.total_expected_sequences = None  # Track total expected sequences
+        # select: blocking loop over all ports, asyncio: one DatagramProtocol endpoint per port
+        self.engine = engine
+        self.loop = None
+        self.ack_handle = None  # Pending call_later that flushes ACKs in the asyncio engine
+        
+        # Received payloads go straight from the reusable receive buffer into the reassembly buffer
+        self.receive_buffer = bytearray(MAX_DATAGRAM)
+        self.transfers = {}  # session id -> Transfer in progress
+        self.finished_sessions = OrderedDict()  # session id -> total sequences, most recent last
+        self.free_buffers = []  # Cleared ReassemblyBuffers of finished transfers, guarded by ack_lock
+        self.last_eviction = time.time()
+        
+        # SACKs are sent every ack_every packets of a session or after ack_interval seconds
+        self.ack_lock = threading.Lock()  # Guards transfers, finished_sessions and the ACK state of each transfer
+        self.ack_every = ack_every
+        self.ack_interval = ack_interval
         self.last_update_time = time.time()
         self.packets = []  # Store packets for Flask display
+        self.packets_lock = threading.Lock()  # packets and last_update_time change together
+        self.packets_cache = {}  # (offset, limit) -> (etag, JSON body), valid for packets_cache_time
+        self.packets_cache_time = None
         
-    def decompress_with_lzma(self, compressed_data: bytes) -> str:
-        return lzma.decompress(compressed_data).decode("utf-8")
+    def get_transfer(self, session_id: int, total_sequences: int = 0):
+        """The transfer of a session, started on its first datagram; None if the session already finished.
+        A known total that differs from the finished one means a restarted server reused the id, a new transfer"""
+        with self.ack_lock:
+            finished_total = self.finished_sessions.get(session_id)
+            if finished_total is not None:
+                if not total_sequences or total_sequences == finished_total:
+                    return None
+                del self.finished_sessions[session_id]
+            transfer = self.transfers.get(session_id)
+            if transfer is None:
+                buffer = self.free_buffers.pop() if self.free_buffers else None
+                transfer = self.transfers[session_id] = Transfer(session_id, buffer)
+            return transfer
+
+    def release_buffer(self, transfer: Transfer):
+        """Hand the reassembly buffer of a transfer that is done with it to the next transfer"""
+        with self.ack_lock:
+            self._release_buffer(transfer)
+
+    def _release_buffer(self, transfer: Transfer):
+        """Caller holds ack_lock"""
+        if transfer.buffer is not None and len(self.free_buffers) < FREE_BUFFERS:
+            transfer.buffer.clear()
+            self.free_buffers.append(transfer.buffer)
+        transfer.buffer = None
+
+    def complete_transfer(self, transfer: Transfer):
+        """Send the final SACK and retire the session; the transfer is then finished by process_complete_data"""
+        with self.ack_lock:
+            self._flush_acks(transfer)
+            self.transfers.pop(transfer.session_id, None)
+            self.finished_sessions[transfer.session_id] = transfer.total_expected_sequences
+            if len(self.finished_sessions) > FINISHED_SESSIONS:
+                self.finished_sessions.popitem(last=False)
+
+    def evict_idle_transfers(self, now: float):
+        """Drop sessions that stopped receiving, e.g. after the server gave up on them"""
+        with self.ack_lock:
+            for session_id, transfer in list(self.transfers.items()):
+                if now - transfer.last_activity > SESSION_IDLE_TIMEOUT:
+                    print(f"Dropping idle session {session_id} with {len(transfer.received_sequences)} packets")
+                    del self.transfers[session_id]
+                    self._release_buffer(transfer)
+        self.last_eviction = now
         
     def split_packets(self, data: str, delimiter: str = "|") -> list:
         return data.split(delimiter)
         
-    def send_ack(self, sequence_number: int):
-        """Send ACK for a specific sequence number"""
-        ack_message = f"ACK:{sequence_number}".encode("utf-8")
-        self.ack_socket.sendto(ack_message, self.server_address)
+    def send_ack(self, transfer: Transfer, sequence_number: int):
+        """Record a received sequence; a SACK goes out every ack_every sequences, the timer sends the rest"""
+        with self.ack_lock:
+            if sequence_number == transfer.cumulative_ack:
+                transfer.cumulative_ack += 1
+                while transfer.cumulative_ack in transfer.out_of_order:
+                    transfer.out_of_order.remove(transfer.cumulative_ack)
+                    transfer.cumulative_ack += 1
+            elif sequence_number > transfer.cumulative_ack:
+                transfer.out_of_order.add(sequence_number)
+            transfer.pending_acks += 1
+            if transfer.pending_acks >= self.ack_every:
+                self._flush_acks(transfer)
+
+    def handle_duplicate(self, transfer: Transfer, sequence_number: int, retransmitted: bool = False):
+        """Keep the first copy. A redundant copy from the other path only needs the SACK repeated on the next tick,
+        a retransmission means the server missed our SACK, so it is repeated at once"""
+        with self.ack_lock:
+            if retransmitted:
+                self._flush_acks(transfer)
+            else:
+                transfer.pending_acks = max(transfer.pending_acks, 1)
+
+    def ack_finished(self, session_id: int, total_sequences: int):
+        """A packet of a finished session means the final SACK was lost, acknowledge everything again.
+        Only when the packet's total matches, a different total is a new server reusing the session id"""
+        with self.ack_lock:
+            total = self.finished_sessions.get(session_id)
+        if total is not None and total == total_sequences:
+            for datagram in encode_sack(session_id, total, ()):
+                self.ack_socket.sendto(datagram, self.server_address)
+
+    def _flush_acks(self, transfer: Transfer):
+        """Send the cumulative ACK and bitmap of a session; caller holds ack_lock"""
+        for datagram in encode_sack(transfer.session_id, transfer.cumulative_ack, transfer.out_of_order):
+            self.ack_socket.sendto(datagram, self.server_address)
+        transfer.pending_acks = 0
+
+    def flush_acks(self):
+        with self.ack_lock:
+            for transfer in self.transfers.values():
+                if transfer.pending_acks:
+                    self._flush_acks(transfer)
+
+    def _ack_timer(self):
+        while True:
+            time.sleep(self.ack_interval)
+            self.flush_acks()
         
-    def check_completion(self) -> bool:
+    def check_completion(self, transfer: Transfer) -> bool:
         """Check if all expected packets have been received"""
-        if self.total_expected_sequences is None:
-            return False
-        return self.total_expected_sequences == len(self.received_sequences)
+        return transfer.is_complete()
         
-    def process_complete_data(self):
-        """Process and decompress complete data when all packets are received"""
+    def handle_parity(self, transfer: Transfer, payload):
+        """Store a parity datagram and try to rebuild its block"""
+        first_sequence, count, total_sequences, length_xor, parity = parse_parity(payload)
+        parity = bytes(parity)  # payload is a view of the reused receive buffer
+        if total_sequences:
+            # 0 means the server was still compressing (streaming) and did not know the total yet
+            transfer.total_expected_sequences = total_sequences
+        if all(seq in transfer.received_sequences for seq in range(first_sequence, first_sequence + count)):
+            return
+        transfer.parity_blocks[first_sequence] = (count, length_xor, parity)
+        for seq in range(first_sequence, first_sequence + count):
+            transfer.parity_index[seq] = first_sequence
+        self.try_recover(transfer, first_sequence)
+
+    def try_recover(self, transfer: Transfer, first_sequence: int):
+        """Rebuild the missing chunk of a parity block when exactly one is missing"""
+        count, length_xor, parity = transfer.parity_blocks[first_sequence]
+        block = range(first_sequence, first_sequence + count)
+        missing = [seq for seq in block if seq not in transfer.received_sequences]
+        if len(missing) == 1:
+            present = []
+            for seq in block:
+                if seq != missing[0]:
+                    with transfer.buffer.view(seq) as chunk:
+                        present.append(bytes(chunk))
+            recovered = recover_chunk(parity, length_xor, present)
+            is_last = (transfer.total_expected_sequences == missing[0] + 1
+                       or (transfer.buffer.chunk_size is not None and len(recovered) < transfer.buffer.chunk_size))
+            transfer.buffer.put(missing[0], recovered, is_last)
+            transfer.received_sequences.add(missing[0])
+            self.send_ack(transfer, missing[0])
+            print(f"Recovered packet {missing[0]} from parity")
+            self.feed(transfer)
+            missing = []
+        if not missing:
+            del transfer.parity_blocks[first_sequence]
+            for seq in block:
+                transfer.parity_index.pop(seq, None)
+
+    def feed(self, transfer: Transfer):
+        """Decompress the contiguous prefix of a transfer. The asyncio engine hands the chunks to the
+        transfer's decompression job instead, so the event loop never waits for a decompressor"""
+        if self.engine != 'asyncio':
+            transfer.feed_contiguous()
+            return
+        chunks = transfer.take_contiguous()
+        if chunks:
+            self._queue_feed(transfer, chunks)
+
+    def _queue_feed(self, transfer: Transfer, chunks: list = (), finishing: bool = False):
+        """Queue chunks for the decompression job of a transfer, starting the job in the default executor
+        if none is running; one job per transfer keeps its chunks in order"""
+        with transfer.feed_lock:
+            transfer.feed_queue.extend(chunks)
+            transfer.finishing = transfer.finishing or finishing
+            if transfer.feed_running:
+                return
+            transfer.feed_running = True
+        self.loop.run_in_executor(None, self._run_feed, transfer)
+
+    def _run_feed(self, transfer: Transfer):
+        """Decompression job: drains the queue of a transfer, then finishes it once every chunk is queued"""
+        while True:
+            with transfer.feed_lock:
+                chunks, transfer.feed_queue = transfer.feed_queue, []
+                if not chunks:
+                    if not transfer.finishing:
+                        transfer.feed_running = False
+                        return
+                    break
+            if transfer.feed_error is not None:
+                continue  # The stream is already broken, finish() reports it
+            try:
+                for chunk in chunks:
+                    transfer.decompress(chunk)
+            except (DECOMPRESS_ERRORS + (UnicodeDecodeError,)) as e:
+                transfer.feed_error = e
+        self.process_complete_data(transfer)
+
+    def process_complete_data(self, transfer: Transfer):
+        """Finish decompression when all packets of a transfer are received"""
         try:
-            # Combine all packets in order
-            sorted_data = b"".join(self.buffer[i] for i in range(self.total_expected_sequences))
-            
-            # Decompress data
-            decompressed_data = self.decompress_with_lzma(sorted_data)
-            self.packets = self.split_packets(decompressed_data)
-            self.last_update_time = time.time()
-            print(f"\nReceived and processed {len(self.packets)} packets successfully")
-            
-            # Clear buffers for next transmission
-            self.buffer.clear()
-            self.received_sequences.clear()
-            self.total_expected_sequences = None  # Reset expected sequences
-            
+            packets = self.split_packets(transfer.finish())
+            with self.packets_lock:
+                self.packets = packets
+                self.last_update_time = time.time()
+            print(f"\nReceived and processed {len(packets)} packets successfully (session {transfer.session_id})")
             return True
-        except lzma.LZMAError as e:
+        except (DECOMPRESS_ERRORS + (UnicodeDecodeError,)) as e:
             print(f"Error decompressing data: {e}")
             return False
+        finally:
+            self.release_buffer(transfer)
+            
+    def encode_packets(self, offset: int = 0, limit: int = None) -> tuple:
+        """Returns (etag, JSON body) of a page of decoded packets, encoded once per last_update_time"""
+        with self.packets_lock:
+            if self.packets_cache_time != self.last_update_time:
+                self.packets_cache.clear()
+                self.packets_cache_time = self.last_update_time
+            key = (offset, limit)
+            if key not in self.packets_cache:
+                if len(self.packets_cache) >= PACKETS_CACHE_ENTRIES:
+                    self.packets_cache.pop(next(iter(self.packets_cache)))
+                end = None if limit is None else offset + limit
+                body = json.dumps({
+                    "total": len(self.packets),
+                    "offset": offset,
+                    "limit": limit,
+                    "packets": self.packets[offset:end],
+                    "timestamp": self.last_update_time
+                }, separators=(",", ":"))
+                self.packets_cache[key] = (f"{self.last_update_time!r}-{offset}-{limit}", body)
+            return self.packets_cache[key]
+
+    def handle_datagram(self, message, size: int):
+        """Process one datagram held in message[:size]; returns its transfer when the datagram completed it"""
+        now = time.time()
+        if now - self.last_eviction > 1.0:
+            self.evict_idle_transfers(now)
+        
+        # The fixed header is parsed once; the payload length comes from it, nothing scans the payload
+        if size < DATA_HEADER.size:
+            return None
+        version, flags, codec_id, session_id, sequence_number, total_sequences, length, crc = parse_header(message)
+        if version != HEADER_VERSION:
+            print(f"Dropping packet with header version {version}")
+            return None
+        if DATA_HEADER.size + length > size:
+            print(f"Dropping truncated packet {sequence_number} of session {session_id}")
+            return None
+        payload = memoryview(message)[DATA_HEADER.size:DATA_HEADER.size + length]
+        if flags & FLAG_CRC and zlib.crc32(payload) != crc:
+            print(f"Dropping corrupt packet {sequence_number} of session {session_id}")
+            return None
+        # The total this packet tells, 0 while a streamed transfer does not know it yet
+        known_total = total_sequences or (sequence_number + 1 if flags & FLAG_LAST else 0)
+        transfer = self.get_transfer(session_id, known_total)
+        if transfer is None:
+            self.ack_finished(session_id, known_total)
+            return None
+        transfer.last_activity = now
+        if total_sequences and transfer.total_expected_sequences is None:
+            # Any packet tells the total, so completion and gaps are known before the last one arrives
+            transfer.total_expected_sequences = total_sequences
+        # Parity datagrams carry the codec too, a transfer rebuilt from parity alone still decompresses
+        transfer.codec_id = codec_id
+        
+        if flags & FLAG_PARITY:
+            # Parity datagram, rebuilds a lost chunk without a retransmission
+            self.handle_parity(transfer, payload)
+        else:
+            is_last = bool(flags & FLAG_LAST)
+            if is_last:
+                transfer.total_expected_sequences = sequence_number + 1
+            
+            if sequence_number in transfer.received_sequences:
+                # Redundant copy from the other path or a retransmission
+                self.handle_duplicate(transfer, sequence_number, bool(flags & FLAG_RETRANSMIT))
+                return None
             
+            # Store data and send ACK
+            if transfer.total_expected_sequences is not None:
+                transfer.buffer.reserve_sequences(transfer.total_expected_sequences)
+            transfer.buffer.put(sequence_number, payload, is_last)
+            transfer.received_sequences.add(sequence_number)
+            self.send_ack(transfer, sequence_number)
+            if sequence_number in transfer.parity_index:
+                self.try_recover(transfer, transfer.parity_index[sequence_number])
+            self.feed(transfer)
+            if is_last and not transfer.is_complete():
+                # Report the gaps before the tail right away instead of on the next timer tick
+                self.flush_acks()
+        
+        # Process complete transmission if we have all packets
+        if not self.check_completion(transfer):
+            return None
+        self.complete_transfer(transfer)
+        return transfer
+
     def start_receiving(self):
         """Main receive loop"""
+        if self.engine == 'asyncio':
+            asyncio.run(self.receive_async())
+            return
         print("Client started listening for packets...")
-        is_last = False
+        threading.Thread(target=self._ack_timer, daemon=True).start()
         while True:
             readable, _, _ = select.select(self.receive_sockets, [], [])
             
             for sock in readable:
                 try:
-                    message, _ = sock.recvfrom(65535)
-                    
-                    # Extract sequence number and data
-                    sequence_number = int.from_bytes(message[:4], "big")
-                    data = message[4:]
-                    
-                    # Check for END marker and total sequence count
-                    if b"END" in data:
-                        data, end_info = data.split(b"END", 1)
-                        is_last = True
-                        # Extract total sequence count from end_info
-                        self.total_expected_sequences = sequence_number+1
-                    
-                    # Store data and send ACK
-                    self.buffer[sequence_number] = data
-                    self.received_sequences.add(sequence_number)
-                    self.send_ack(sequence_number)
-                    
-                    # Process complete transmission if we have all packets
-                    if is_last and self.check_completion():
-                        self.process_complete_data()
-                        is_last = False
+                    size, _ = sock.recvfrom_into(self.receive_buffer)
+                    completed = self.handle_datagram(self.receive_buffer, size)
+                    if completed is not None:
+                        self.process_complete_data(completed)
                         
                 except Exception as e:
                     print(f"Error processing packet: {e}")
 
+    async def receive_async(self):
+        """asyncio receive engine: socket reads never wait for decompression, each transfer's runs in the default executor"""
+        print("Client started listening for packets (asyncio)...")
+        self.loop = asyncio.get_running_loop()
+        for sock in self.receive_sockets:
+            sock.setblocking(False)
+            await self.loop.create_datagram_endpoint(lambda: DatagramEndpoint(self), sock=sock)
+        await asyncio.Event().wait()
+
+    def on_datagram(self, data: bytes):
+        try:
+            completed = self.handle_datagram(data, len(data))
+            if completed is not None:
+                # Finish the transfer off the event loop, after its queued chunks; other sessions keep receiving
+                self._queue_feed(completed, completed.take_contiguous(), finishing=True)
+        except Exception as e:
+            print(f"Error processing packet: {e}")
+        self._schedule_ack_flush()
+
+    def _schedule_ack_flush(self):
+        """Batch the ACKs of one ack_interval into a single SACK per session"""
+        if self.ack_handle is None and any(transfer.pending_acks for transfer in self.transfers.values()):
+            self.ack_handle = self.loop.call_later(self.ack_interval, self._scheduled_ack_flush)
+
+    def _scheduled_ack_flush(self):
+        self.ack_handle = None
+        self.flush_acks()
+
 # Flask app setup
 app = Flask(__name__)
-client = UDPClient()
+client = UDPClient(engine=CLIENT_ENGINE)
 
 @app.route('/')
 def index():
@@ -110,11 +538,19 @@ def index():
 
 @app.route('/packets')
 def get_packets():
-    return jsonify({
-        "total": len(client.packets),
-        "packets": client.packets,
-        "timestamp": client.last_update_time  # 使用類別中儲存的時間戳
-    })
+    # ?offset=&limit= pages the packets, unchanged data is answered with 304 via ETag/If-None-Match
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    if offset < 0 or (limit is not None and limit < 0):
+        return Response('{"error":"offset and limit must not be negative"}', status=400, mimetype='application/json')
+    etag, body = client.encode_packets(offset, limit)  # 使用類別中儲存的時間戳
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 def run_flask():
     app.run(host='0.0.0.0', port=4444, threaded=True)
@@ -0,0 +1,168 @@
+import struct
+import zlib
+import bz2
+import lzma
+
+# Wire-format helpers shared by server.py and client.py
+
+# Every datagram starts with a fixed header: version, flags, codec id, session, sequence number,
+# total sequences of the transfer (0 while still unknown), payload length and CRC32 of the payload
+# (0 unless FLAG_CRC). Sessions let several transfers share the paths, and keep late retransmissions
+# of a finished transfer out of the next one. Session ids are 32 bits, so the ids of a restarted server
+# practically never meet the finished sessions a client still remembers
+DATA_HEADER = struct.Struct("!BBBxIIIHI")
+HEADER_VERSION = 2
+SESSION_MODULO = 1 << 32
+FLAG_LAST = 0x01  # Last data sequence of the transfer
+FLAG_PARITY = 0x02  # XOR parity of a block, the sequence field holds the block index
+FLAG_RETRANSMIT = 0x04  # Resent after a timeout
+FLAG_CRC = 0x08  # The CRC32 field is set
+# Largest UDP payload over IPv4, and the largest chunk that still fits with the header and a parity header
+MAX_UDP_PAYLOAD = 65507
+# first sequence of the block, sequences in the block, total sequences, XOR of the chunk lengths
+PARITY_HEADER = struct.Struct("!IHII")
+MAX_CHUNK_SIZE = MAX_UDP_PAYLOAD - DATA_HEADER.size - PARITY_HEADER.size
+
+def xor_bytes(chunks: list) -> bytes:
+    """XOR chunks together, shorter chunks are zero padded to the longest one"""
+    size = max(len(chunk) for chunk in chunks)
+    result = 0
+    for chunk in chunks:
+        result ^= int.from_bytes(chunk.ljust(size, b"\0"), "big")
+    return result.to_bytes(size, "big")
+
+def build_parity(first_sequence: int, chunks: list, total_sequences: int) -> bytes:
+    length_xor = 0
+    for chunk in chunks:
+        length_xor ^= len(chunk)
+    return PARITY_HEADER.pack(first_sequence, len(chunks), total_sequences, length_xor) + xor_bytes(chunks)
+
+def parse_parity(payload: bytes) -> tuple:
+    """Returns (first_sequence, count, total_sequences, length_xor, parity)"""
+    first_sequence, count, total_sequences, length_xor = PARITY_HEADER.unpack_from(payload)
+    return first_sequence, count, total_sequences, length_xor, payload[PARITY_HEADER.size:]
+
+def recover_chunk(parity: bytes, length_xor: int, present_chunks: list) -> bytes:
+    """Rebuild the single missing chunk of a block from its parity and the chunks that arrived"""
+    for chunk in present_chunks:
+        length_xor ^= len(chunk)
+    return xor_bytes([parity] + present_chunks)[:length_xor]
+
+class RawStream:
+    """Pass-through stand-in for the incremental compressor/decompressor objects"""
+    def compress(self, data: bytes) -> bytes:
+        return bytes(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return bytes(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+class Codec:
+    """A compression scheme and preset, identified on the wire by a one-byte id"""
+    def __init__(self, codec_id: int, family: str, preset: int = None):
+        self.codec_id = codec_id
+        self.family = family
+        self.preset = preset
+        self.name = family if preset is None else f"{family}-{preset}"
+
+    def compress(self, data: bytes) -> bytes:
+        if self.family == 'zlib':
+            return zlib.compress(data, self.preset)
+        if self.family == 'bz2':
+            return bz2.compress(data, self.preset)
+        if self.family == 'lzma':
+            return lzma.compress(data, preset=self.preset)
+        return bytes(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.family == 'zlib':
+            return zlib.decompress(data)
+        if self.family == 'bz2':
+            return bz2.decompress(data)
+        if self.family == 'lzma':
+            return lzma.decompress(data)
+        return bytes(data)
+
+    def compressor(self):
+        """Incremental compressor with compress()/flush()"""
+        if self.family == 'zlib':
+            return zlib.compressobj(self.preset)
+        if self.family == 'bz2':
+            return bz2.BZ2Compressor(self.preset)
+        if self.family == 'lzma':
+            return lzma.LZMACompressor(preset=self.preset)
+        return RawStream()
+
+    def decompressor(self):
+        """Incremental decompressor with decompress(); only zlib and raw also have flush()"""
+        if self.family == 'zlib':
+            return zlib.decompressobj()
+        if self.family == 'bz2':
+            return bz2.BZ2Decompressor()
+        if self.family == 'lzma':
+            return lzma.LZMADecompressor()
+        return RawStream()
+
+CODECS = {
+    codec.codec_id: codec
+    for codec in (
+        Codec(0, 'raw'),
+        Codec(1, 'zlib', 1), Codec(2, 'zlib', 6), Codec(3, 'zlib', 9),
+        Codec(4, 'bz2', 1), Codec(5, 'bz2', 9),
+        Codec(6, 'lzma', 0), Codec(7, 'lzma', 6), Codec(8, 'lzma', 9),
+    )
+}
+CODECS_BY_NAME = {codec.name: codec for codec in CODECS.values()}
+DEFAULT_CODEC = 'lzma-6'
+DECOMPRESS_ERRORS = (lzma.LZMAError, zlib.error, OSError, ValueError, EOFError)
+
+def pack_header(session_id: int, sequence_number: int, codec_id: int = 0, total_sequences: int = 0,
+                payload: bytes = b"", flags: int = 0, checksum: bool = False) -> bytes:
+    crc = 0
+    if checksum:
+        flags |= FLAG_CRC
+        crc = zlib.crc32(payload)
+    return DATA_HEADER.pack(HEADER_VERSION, flags, codec_id, session_id, sequence_number, total_sequences,
+                            len(payload), crc)
+
+def parse_header(message) -> tuple:
+    """Returns (version, flags, codec_id, session_id, sequence_number, total_sequences, payload_length, crc)"""
+    return DATA_HEADER.unpack_from(message)
+
+# Selective ACK: type, session, cumulative ACK (every sequence below it was received), bitmap base,
+# bitmap length in bytes. Bit i of the little-endian bitmap acknowledges sequence base + i
+SACK_HEADER = struct.Struct("!BIIIH")
+SACK_TYPE = 0x53
+SACK_MAX_BITS = 8192
+
+def encode_sack(session_id: int, cumulative: int, sequences) -> list:
+    """SACK datagrams of a session for a cumulative ACK plus the out-of-order sequences received above it.
+    Usually one datagram; more only when those sequences span more than SACK_MAX_BITS"""
+    ordered = sorted(sequences)
+    datagrams = []
+    i = 0
+    while True:
+        base = ordered[i] if i < len(ordered) else cumulative
+        bitmap = 0
+        top = base
+        while i < len(ordered) and ordered[i] < base + SACK_MAX_BITS:
+            bitmap |= 1 << (ordered[i] - base)
+            top = ordered[i]
+            i += 1
+        length = (top - base) // 8 + 1 if bitmap else 0
+        datagrams.append(SACK_HEADER.pack(SACK_TYPE, session_id, cumulative, base, length) + bitmap.to_bytes(length, "little"))
+        if i >= len(ordered):
+            return datagrams
+
+def decode_sack(message: bytes) -> tuple:
+    """Returns (session, cumulative, selectively acknowledged sequences)"""
+    _, session_id, cumulative, base, length = SACK_HEADER.unpack_from(message)
+    bitmap = int.from_bytes(message[SACK_HEADER.size:SACK_HEADER.size + length], "little")
+    sequences = []
+    while bitmap:
+        lowest = bitmap & -bitmap
+        sequences.append(base + lowest.bit_length() - 1)
+        bitmap ^= lowest
+    return session_id, cumulative, sequences
@@ -1,26 +1,106 @@
 import socket
 import threading
 import time
-import lzma
-from collections import defaultdict
+from collections import OrderedDict
+from array import array
+import hashlib
 import queue
 import json
 from datetime import datetime
-from flask import Flask, jsonify, send_from_directory, request
+from flask import Flask, Response, jsonify, send_from_directory, request
 from flask_cors import CORS
 import os
+import random
+from protocol import (FLAG_LAST, FLAG_PARITY, FLAG_RETRANSMIT, MAX_CHUNK_SIZE, SACK_TYPE, SESSION_MODULO, CODECS_BY_NAME,
+                      DEFAULT_CODEC, build_parity, pack_header, decode_sack)
 
-def compress_with_lzma(data: str) -> bytes:
-    return lzma.compress(data.encode("utf-8"))
+# Assumed link rate (bytes/s) for automatic codec selection before a window-mode run has been measured
+DEFAULT_LINK_RATE = 12.5 * 1024 * 1024
+# Bytes of the payload compressed with every codec to profile it for automatic selection
+CODEC_SAMPLE_SIZE = 256 * 1024
+# Packets generated and fed to the compressor per step in streaming mode
+STREAM_PIECE_PACKETS = 2000
+# Placeholder for total_sequences while a streamed payload is still being compressed
+UNKNOWN_TOTAL = 0x7FFFFFFF
+# Most transfers one toggle request may start side by side
+MAX_PARALLEL_TRANSFERS = 8
+
+def profile_codec(codec, sample: bytes) -> dict:
+    """Measure compression ratio and per-byte compress/decompress cost of a codec on a sample"""
+    start = time.perf_counter()
+    compressed = codec.compress(sample)
+    compress_time = time.perf_counter() - start
+    start = time.perf_counter()
+    codec.decompress(compressed)
+    decompress_time = time.perf_counter() - start
+    return {
+        'ratio': len(compressed) / len(sample),
+        'compress_cost': compress_time / len(sample),
+        'decompress_cost': decompress_time / len(sample)
+    }
 
 def generate_packet_data(start: int, end: int, delimiter: str = "|", prefix: str = "Packet") -> str:
     return delimiter.join(f"{prefix} {i}" for i in range(start, end + 1))
+
+def generate_packet_pieces(start: int, end: int, delimiter: str = "|", prefix: str = "Packet", step: int = STREAM_PIECE_PACKETS):
+    """generate_packet_data in pieces, so the payload never has to exist as one string"""
+    for piece_start in range(start, end + 1, step):
+        piece = generate_packet_data(piece_start, min(piece_start + step - 1, end), delimiter, prefix)
+        yield piece if piece_start == start else delimiter + piece
      
+# Packet events kept by UDPServerMonitor; older events are overwritten
+MONITOR_EVENT_CAPACITY = 5000
+# Column order of the compact event rows returned by /api/stats?since=<cursor>
+EVENT_FIELDS = ('id', 'sequence', 'timestamp', 'path', 'size', 'type', 'status', 'acks', 'session')
+EVENT_FIELDS_JSON = json.dumps(EVENT_FIELDS, separators=(",", ":"))
+# Seconds between coalesced /api/stream updates, and between keepalives when nothing changes
+STREAM_UPDATE_INTERVAL = 0.1
+STREAM_KEEPALIVE = 15.0
+
+class PacketEvent:
+    """One sent or acked packet in the monitor's ring buffer"""
+    __slots__ = ('event_id', 'sequence', 'timestamp', 'path', 'size', 'type', 'status', 'acks', 'session')
+
+    def __init__(self, event_id, sequence, timestamp, path, size, type, status, session=0):
+        self.event_id = event_id
+        self.session = session
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.path = path
+        self.size = size
+        self.type = type
+        self.status = status
+        self.acks = None  # For an ACK, the id of the send event it acknowledged
+
+    def to_row(self) -> tuple:
+        return (self.event_id, self.sequence, self.timestamp, self.path, self.size, self.type, self.status, self.acks,
+                self.session)
+
+    def to_dict(self) -> dict:
+        if self.type == 'acked':
+            return {'sequence': self.sequence, 'timestamp': self.timestamp, 'type': self.type, 'status': self.status,
+                    'session': self.session}
+        return {'sequence': self.sequence, 'timestamp': self.timestamp, 'path': self.path,
+                'size': self.size, 'type': self.type, 'status': self.status, 'session': self.session}
+
 class UDPServerMonitor:
-    def __init__(self):
+    def __init__(self, capacity: int = MONITOR_EVENT_CAPACITY):
         self.stats_queue = queue.Queue()
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        # Event ids keep increasing across resets so a cursor from an old session is never mistaken for a new one
+        self.next_event_id = 0
+        # Bumped on every update; the serialized aggregates are cached per version
+        self.version = 0
+        self._aggregates_version = -1
+        self._aggregates_json = None
+        self._reset_state()
+        self._start_stats_processor()
+
+    def _reset_state(self):
         self.current_stats = {
             'compression': {
+                'codec': DEFAULT_CODEC,
                 'original_size': 0,
                 'compressed_size': 0,
                 'ratio': 0
@@ -42,31 +122,60 @@ class UDPServerMonitor:
                 'path1': {'packets': 0, 'success': 0},
                 'path2': {'packets': 0, 'success': 0}
             },
-            'packets': [], # List of {sequence, timestamp, path}
-            
+            'scheduler': {'name': 'static', 'paths': {}},
+            'fec': {'parity_sent': 0},
+            'cache': {'hits': 0, 'misses': 0, 'entries': 0},
         }
-        self._start_stats_processor()
+        # Ring buffer of the last `capacity` packet events, event i lives in slot i % capacity
+        self.events = [None] * self.capacity
+        self.first_event_id = self.next_event_id
+        # (session, sequence) -> latest unacked 'sent' event still in the ring
+        self.sent_index = {}
 
     def reset_stats(self):
-        self.__init__()
+        # Queued so it is applied in order with the events recorded before and after it
+        self.stats_queue.put({'type': 'reset'})
 
     def _start_stats_processor(self):
         def process_stats():
             while True:
                 try:
                     stat = self.stats_queue.get()
-                    self._update_stats(stat)
+                    with self.lock:
+                        self._update_stats(stat)
                 except Exception as e:
                     print(f"Error processing stats: {e}")
 
         thread = threading.Thread(target=process_stats, daemon=True)
         thread.start()
 
+    def _append_event(self, sequence, timestamp, path, size, event_type, status, session) -> PacketEvent:
+        slot = self.next_event_id % self.capacity
+        evicted = self.events[slot]
+        if evicted is not None and self.sent_index.get((evicted.session, evicted.sequence)) is evicted:
+            del self.sent_index[(evicted.session, evicted.sequence)]
+        event = PacketEvent(self.next_event_id, sequence, timestamp, path, size, event_type, status, session)
+        self.events[slot] = event
+        self.next_event_id += 1
+        return event
+
+    def oldest_event_id(self) -> int:
+        return max(self.first_event_id, self.next_event_id - self.capacity)
+
+    def iter_events(self, since: int = 0):
+        """Events still in the ring with id >= since, oldest first"""
+        for event_id in range(max(since, self.oldest_event_id()), self.next_event_id):
+            yield self.events[event_id % self.capacity]
+
     def _update_stats(self, stat):
         stat_type = stat.get('type')
 
-        if stat_type == 'compression_info':
+        if stat_type == 'reset':
+            self._reset_state()
+
+        elif stat_type == 'compression_info':
             self.current_stats['compression'].update({
+                'codec': stat['codec'],
                 'original_size': stat['original_size'],
                 'compressed_size': stat['compressed_size'],
                 'ratio': stat['ratio']
@@ -89,72 +198,651 @@ class UDPServerMonitor:
                 'average_packet_loss_rate': stat['average_packet_loss_rate']
             })
 
-        elif stat_type == 'packet_sent':
-            self.current_stats['packets'].append({
-                'sequence': stat['sequence'],
-                'timestamp': stat['timestamp'],
-                'path': stat['path'],
-                'size': stat['size'],
-                'type': 'sent',
-                'status': 'sent'
+        elif stat_type == 'scheduler_update':
+            self.current_stats['scheduler'].update({
+                'name': stat['name'],
+                'paths': stat['paths']
+            })
+
+        elif stat_type == 'cache_stats':
+            self.current_stats['cache'].update({
+                'hits': stat['hits'],
+                'misses': stat['misses'],
+                'entries': stat['entries']
             })
+
+        elif stat_type == 'parity_sent':
+            # Shown on its path but never acknowledged, so it stays out of sent_index
+            self._append_event(stat['block'], stat['timestamp'], stat['path'], stat['size'], 'parity', 'sent',
+                               stat.get('session', 0))
+            self.current_stats['fec']['parity_sent'] += 1
+            self.current_stats['paths'][stat['path']]['packets'] += 1
+
+        elif stat_type == 'packet_sent':
+            session = stat.get('session', 0)
+            event = self._append_event(stat['sequence'], stat['timestamp'], stat['path'], stat['size'], 'sent', 'sent', session)
+            self.sent_index[(session, stat['sequence'])] = event
             self.current_stats['paths'][stat['path']]['packets'] += 1
 
         elif stat_type == 'packet_acked':
-            self.current_stats['packets'].append({
-                'sequence': stat['sequence'],
-                'timestamp': stat['timestamp'],
-                'type': 'acked',
-                'status': 'sent'
-            })
-            for packet in self.current_stats['packets']:
-                if packet['status'] == 'sent' and packet['sequence'] == stat['sequence']:
-                    packet['status'] = 'acked'
-                    self.current_stats['paths'][packet['path']]['success'] += 1
-                    break
+            session = stat.get('session', 0)
+            ack = self._append_event(stat['sequence'], stat['timestamp'], None, None, 'acked', 'sent', session)
+            sent = self.sent_index.pop((session, stat['sequence']), None)
+            if sent is not None:
+                sent.status = 'acked'
+                ack.acks = sent.event_id
+                self.current_stats['paths'][sent.path]['success'] += 1
+
+        self.version += 1
 
     def record_event(self, event_type, **kwargs):
         self.stats_queue.put({'type': event_type, **kwargs})
 
     def get_current_stats(self):
-        return json.dumps(self.current_stats)
+        with self.lock:
+            return json.dumps({**self.current_stats, 'packets': [event.to_dict() for event in self.iter_events()]})
+
+    def _aggregates(self) -> str:
+        """current_stats without packet events, serialized once per version; caller holds lock"""
+        if self._aggregates_version != self.version:
+            self._aggregates_json = json.dumps(self.current_stats)
+            self._aggregates_version = self.version
+        return self._aggregates_json
+
+    def encode_since(self, since: int) -> tuple:
+        """Returns (version, cursor, JSON text) of the aggregates plus the packet events with id >= since,
+        as rows in EVENT_FIELDS order. Readers drop their events with id < first (evicted or from a previous
+        session) and ask again with cursor"""
+        with self.lock:
+            if since > self.next_event_id:
+                # Cursor from before a server restart
+                since = 0
+            rows = [event.to_row() for event in self.iter_events(since)]
+            text = (f'{{"cursor":{self.next_event_id},"first":{self.oldest_event_id()},'
+                    f'"fields":{EVENT_FIELDS_JSON},"stats":{self._aggregates()},"events":{json.dumps(rows, separators=(",", ":"))}}}')
+            return self.version, self.next_event_id, text
+
+    def get_stats_since(self, since: int) -> str:
+        return self.encode_since(since)[2]
+
+class StatsBroadcaster:
+    """Pushes monitor deltas to /api/stream subscribers as Server-Sent Events.
+    Updates are coalesced to one per interval and each is encoded once, whatever the number of subscribers"""
+    def __init__(self, monitor: UDPServerMonitor, interval: float = STREAM_UPDATE_INTERVAL):
+        self.monitor = monitor
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.subscribers = 0
+        self.tick = 0
+        self.since = 0  # Cursor the current message starts from
+        self.cursor = 0  # Cursor after the current message
+        self.message = None
+        self.version = -1
+        threading.Thread(target=self._run, daemon=True).start()
+
+    @staticmethod
+    def format_event(cursor: int, text: str) -> bytes:
+        return f"id: {cursor}\nevent: stats\ndata: {text}\n\n".encode()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.cond:
+                if not self.subscribers:
+                    continue
+            if self.monitor.version == self.version:
+                continue
+            version, cursor, text = self.monitor.encode_since(self.cursor)
+            with self.cond:
+                self.since, self.cursor, self.version = self.cursor, cursor, version
+                self.message = self.format_event(cursor, text)
+                self.tick += 1
+                self.cond.notify_all()
+
+    def subscribe(self):
+        """Event stream generator for one subscriber, starting with a full snapshot"""
+        with self.cond:
+            self.subscribers += 1
+            tick = self.tick
+        try:
+            _, cursor, text = self.monitor.encode_since(0)
+            yield self.format_event(cursor, text)
+            while True:
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.tick != tick, STREAM_KEEPALIVE):
+                        message = None
+                    else:
+                        tick, since, message_cursor, message = self.tick, self.since, self.cursor, self.message
+                if message is None:
+                    yield b": keepalive\n\n"
+                elif since <= cursor:
+                    # The shared message covers everything after our cursor, repeated events are ignored by id
+                    cursor = message_cursor
+                    yield message
+                else:
+                    # Missed a tick, catch up on our own
+                    _, cursor, text = self.monitor.encode_since(cursor)
+                    yield self.format_event(cursor, text)
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+
+class PathEstimator:
+    """Running loss and delay estimates for one path, fed from the ACK stream, and the path's
+    retransmission timer (RFC 6298 style: SRTT + 4 * RTTVAR with exponential backoff)"""
+    def __init__(self, rtt_alpha: float = 0.125, rtt_beta: float = 0.25, loss_alpha: float = 0.05,
+                 initial_rto: float = 1.0, min_rto: float = 0.05, max_rto: float = 10.0, max_backoff: int = 64):
+        self.rtt_alpha = rtt_alpha
+        self.rtt_beta = rtt_beta
+        self.loss_alpha = loss_alpha
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_backoff = max_backoff
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1  # Doubled on timeout (at most once per RTO), reset by the next valid RTT sample
+        self.last_backoff_time = 0.0
+        self.loss_rate = 0.0
+        self.ack_interval = 0.0  # Smoothed time between ACKs, used as per-packet service time
+        self.last_ack_time = None
+        self.in_flight = 0
+
+    def on_sent(self):
+        self.in_flight += 1
+
+    def on_ack(self, rtt, now: float):
+        """rtt is None for retransmitted sequences, whose ACK is ambiguous (Karn's rule)"""
+        self.in_flight = max(0, self.in_flight - 1)
+        if rtt is not None:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = (1 - self.rtt_beta) * self.rttvar + self.rtt_beta * abs(self.srtt - rtt)
+                self.srtt = (1 - self.rtt_alpha) * self.srtt + self.rtt_alpha * rtt
+            self.backoff = 1
+        self.loss_rate *= (1 - self.loss_alpha)
+        if self.last_ack_time is not None:
+            gap = now - self.last_ack_time
+            self.ack_interval = (1 - self.rtt_alpha) * self.ack_interval + self.rtt_alpha * gap
+        self.last_ack_time = now
+
+    def on_loss(self, now: float):
+        """A copy sent on this path timed out"""
+        self.in_flight = max(0, self.in_flight - 1)
+        self.loss_rate = (1 - self.loss_alpha) * self.loss_rate + self.loss_alpha
+        # Several sequences expiring together are one timeout event, not several
+        if now - self.last_backoff_time >= self.rto():
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            self.last_backoff_time = now
+
+    def rto(self) -> float:
+        if self.srtt is None:
+            base = self.initial_rto
+        else:
+            base = max(self.min_rto, self.srtt + 4 * self.rttvar)
+        return min(base * self.backoff, self.max_rto)
+
+    def expected_completion_time(self) -> float:
+        """Queueing + one round trip + expected cost of the retransmissions a loss triggers"""
+        rtt = self.srtt if self.srtt is not None else self.initial_rto
+        loss = min(self.loss_rate, 0.99)
+        return self.in_flight * self.ack_interval + rtt + loss / (1 - loss) * (rtt + self.rto())
+
+    def snapshot(self) -> dict:
+        return {
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'rto': self.rto(),
+            'loss_rate': self.loss_rate,
+            'in_flight': self.in_flight,
+            'expected_completion_time': self.expected_completion_time()
+        }
+
+class PathScheduler:
+    """Chooses the path for each sequence; subclasses implement select()"""
+    name = 'base'
+
+    def __init__(self, paths: list):
+        self.paths = paths
+
+    def select(self, sequence_number: int, total_sequences: int, estimators: dict) -> str:
+        raise NotImplementedError
+
+class StaticTailScheduler(PathScheduler):
+    """Original rule: the last `tail` sequences go to path1, everything else to path2"""
+    name = 'static'
+
+    def __init__(self, paths: list, tail: int = 5):
+        super().__init__(paths)
+        self.tail = tail
+
+    def select(self, sequence_number, total_sequences, estimators):
+        if sequence_number >= max(0, total_sequences - self.tail):
+            return 'path1'
+        return 'path2'
+
+class WeightedRoundRobinScheduler(PathScheduler):
+    """Smooth weighted round-robin over fixed per-path weights"""
+    name = 'wrr'
+
+    def __init__(self, paths: list, weights: dict = None):
+        super().__init__(paths)
+        self.weights = {path: (weights or {}).get(path, 1) for path in paths}
+        self.current = {path: 0 for path in paths}
+
+    def _next(self, weights: dict) -> str:
+        total = sum(weights.values())
+        for path in self.paths:
+            self.current[path] += weights[path]
+        chosen = max(self.paths, key=lambda path: self.current[path])
+        self.current[chosen] -= total
+        return chosen
+
+    def select(self, sequence_number, total_sequences, estimators):
+        return self._next(self.weights)
+
+class LowestCompletionTimeScheduler(PathScheduler):
+    """Greedy: send each sequence on the path with the lowest expected completion time"""
+    name = 'ect'
+
+    def select(self, sequence_number, total_sequences, estimators):
+        return min(self.paths, key=lambda path: estimators[path].expected_completion_time())
+
+class AdaptiveScheduler(WeightedRoundRobinScheduler):
+    """Weighted round-robin whose weights follow the measured goodput of each path.
+    Every path keeps a minimum share so its estimates stay fresh, and the tail of the
+    transfer goes to the path expected to finish first"""
+    name = 'adaptive'
+
+    def __init__(self, paths: list, min_share: float = 0.05, tail: int = 5):
+        super().__init__(paths)
+        self.min_share = min_share
+        self.tail = tail
+
+    def select(self, sequence_number, total_sequences, estimators):
+        if sequence_number >= total_sequences - self.tail:
+            return min(self.paths, key=lambda path: estimators[path].expected_completion_time())
+        goodput = {path: (1 - min(estimators[path].loss_rate, 0.99)) / max(estimators[path].expected_completion_time(), 1e-3)
+                   for path in self.paths}
+        total = sum(goodput.values())
+        weights = {path: max(goodput[path] / total, self.min_share) for path in self.paths}
+        return self._next(weights)
+
+SCHEDULERS = {
+    scheduler.name: scheduler
+    for scheduler in (StaticTailScheduler, WeightedRoundRobinScheduler, LowestCompletionTimeScheduler, AdaptiveScheduler)
+}
+
+class PayloadCache:
+    """LRU cache of compressed payloads keyed on (prefix, start, end, codec, preset),
+    optionally persisted to cache_dir so later server processes start warm"""
+    def __init__(self, max_entries: int = 8, cache_dir: str = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()  # key -> (original_size, compressed_data)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, key: tuple) -> str:
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.bin")
+
+    def _load(self, key: tuple):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                raw = f.read()
+            return int.from_bytes(raw[:8], "big"), raw[8:]
+        except OSError:
+            return None
+
+    def _store(self, key: tuple, original_size: int, compressed_data: bytes):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(original_size.to_bytes(8, "big") + compressed_data)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Error writing payload cache: {e}")
+
+    def _insert(self, key: tuple, entry: tuple):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __contains__(self, key: tuple) -> bool:
+        """Whether get(key) would hit, without counting it or loading the entry"""
+        with self.lock:
+            if key in self.entries:
+                return True
+        return bool(self.cache_dir) and os.path.exists(self._path(key))
+
+    def get(self, key: tuple):
+        """Returns (original_size, compressed_data) or None, counting the hit or miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            entry = self._load(key)
+            if entry is not None:
+                self._insert(key, entry)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, entry: tuple):
+        with self.lock:
+            self._insert(key, entry)
+        self._store(key, *entry)
+
+    def get_or_build(self, key: tuple, build) -> tuple:
+        """Returns (original_size, compressed_data), calling build() only on a miss"""
+        entry = self.get(key)
+        if entry is None:
+            entry = build()
+            self.put(key, entry)
+        return entry
+
+    def snapshot(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+class CompressedStream:
+    """Compresses a payload on a background thread. A chunk becomes sendable as soon as the
+    compressor has emitted the bytes after it, or when the stream is finished"""
+    def __init__(self, codec, pieces, batch_size: int, on_total, on_progress):
+        self.batch_size = batch_size
+        self.data = bytearray()
+        self.original_size = 0
+        self.available = 0  # Sequences that can be sent
+        self.total_sequences = None
+        self.done = False
+        self.cond = threading.Condition()
+        self.on_total = on_total  # Called with the final sequence count before the last chunk becomes available
+        self.on_progress = on_progress  # Called after new chunks became available
+        self.thread = threading.Thread(target=self._run, args=(codec, pieces), daemon=True)
+        self.thread.start()
+
+    def _append(self, output: bytes, done: bool = False):
+        with self.cond:
+            self.data += output
+            if done:
+                self.total_sequences = (len(self.data) + self.batch_size - 1) // self.batch_size
+                self.on_total(self.total_sequences)
+                self.available = self.total_sequences
+            else:
+                self.available = max(0, (len(self.data) - 1) // self.batch_size)
+            self.done = done
+            self.cond.notify_all()
+        self.on_progress()
+
+    def _run(self, codec, pieces):
+        compressor = codec.compressor()
+        try:
+            for piece in pieces:
+                raw = piece.encode("utf-8")
+                self.original_size += len(raw)
+                output = compressor.compress(raw)
+                if output:
+                    self._append(output)
+        finally:
+            self._append(compressor.flush(), done=True)
+
+    def wait_for(self, seq: int) -> bool:
+        """Block until seq can be sent; False if the stream finished without it"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.done or seq < self.available)
+            return seq < self.available
+
+class AckTracker:
+    """ACK state of a transfer: one byte per sequence plus the unacked sequences as a doubly
+    linked list over two index arrays. Acking is O(1) and walking the unacked set in order is
+    O(unacked), independent of the transfer size. Callers hold the server's ack_lock"""
+    def __init__(self, total: int = 0):
+        self.reset(total)
+
+    def reset(self, total: int = 0):
+        self.acked = bytearray()
+        self.next = array('i')
+        self.prev = array('i')
+        self.head = -1
+        self.tail = -1
+        self.unacked_count = 0
+        self.extend(total)
+
+    def __len__(self) -> int:
+        return len(self.acked)
+
+    def extend(self, total: int):
+        """Grow to total sequences, the new ones unacked (streamed payloads grow while sending)"""
+        start = len(self.acked)
+        if total <= start:
+            return
+        self.acked.extend(bytes(total - start))
+        self.prev.append(self.tail)
+        self.prev.extend(range(start, total - 1))
+        self.next.extend(range(start + 1, total))
+        self.next.append(-1)
+        if self.tail == -1:
+            self.head = start
+        else:
+            self.next[self.tail] = start
+        self.tail = total - 1
+        self.unacked_count += total - start
+
+    def is_acked(self, seq: int) -> bool:
+        return seq < len(self.acked) and self.acked[seq] == 1
+
+    def ack(self, seq: int) -> bool:
+        """Mark seq acknowledged, True if it was not before"""
+        if seq >= len(self.acked) or self.acked[seq]:
+            return False
+        self.acked[seq] = 1
+        prev, next = self.prev[seq], self.next[seq]
+        if prev == -1:
+            self.head = next
+        else:
+            self.next[prev] = next
+        if next == -1:
+            self.tail = prev
+        else:
+            self.prev[next] = prev
+        self.unacked_count -= 1
+        return True
+
+    def ack_below(self, cumulative: int) -> list:
+        """Acknowledge every sequence below cumulative, returns the newly acked ones"""
+        newly_acked = []
+        while self.head != -1 and self.head < cumulative:
+            newly_acked.append(self.head)
+            self.ack(self.head)
+        return newly_acked
+
+    def unacked(self) -> list:
+        """Unacked sequences in ascending order"""
+        sequences = []
+        seq = self.head
+        while seq != -1:
+            sequences.append(seq)
+            seq = self.next[seq]
+        return sequences
+
+class TransferSession:
+    """Send state of one transfer run. The session id goes in every header so several
+    transfers can share the paths at once and late packets of an old run are told apart"""
+    def __init__(self, session_id: int, codec_id: int, send_mode: str, window_size: int, fec_group: int):
+        self.session_id = session_id
+        self.codec_id = codec_id  # Codec of the payload being sent
+        self.send_mode = send_mode
+        self.window_size = window_size
+        self.fec_group = fec_group
+        self.ack_tracker = AckTracker()
+        self.sent_info = {}  # sequence -> (send time, path, retransmitted) of the latest copy sent
+        self.first_sent = {}  # sequence -> time its first copy was sent, for give_up_after
+        self.total_sequences = 0
+        self.total_retransmissions = 0
+        self.last_send_time = 0
+        self.stream = None  # CompressedStream of this run on a streaming cache miss
+
+def percentile(ordered: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+# Distinct since/until ranges whose aggregates are kept between history changes
+HISTORY_AGGREGATES_CACHE = 32
+
+class SessionHistoryStore:
+    """Append-only JSON Lines log of finished sessions, one record per line.
+    Records are also kept in memory in time order for paging, filtering and aggregates"""
+    def __init__(self, path='static/transmission_history.jsonl', legacy_path='static/transmission_history.json'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sessions = []
+        self.aggregates_cache = {}  # (since, until) -> aggregates, emptied whenever the sessions change
+        self.generation = 0  # Bumped by append and clear
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if not os.path.exists(path) and legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+        self._load()
+
+    def _import_legacy(self, legacy_path):
+        """Convert the old whole-file JSON array into the JSONL log once"""
+        try:
+            with open(legacy_path, 'r') as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error importing legacy history: {e}")
+            return
+        with open(self.path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        print(f"Imported {len(records)} sessions from {legacy_path}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            open(self.path, 'w').close()
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    self.sessions.append(json.loads(line))
+                except ValueError:
+                    # Partial line from an interrupted write
+                    continue
+        self.sessions.sort(key=lambda record: record['timestamp'])
+
+    def append(self, record: dict):
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+            self.sessions.append(record)
+            self.aggregates_cache.clear()
+            self.generation += 1
+
+    def clear(self):
+        with self.lock:
+            open(self.path, 'w').close()
+            self.sessions = []
+            self.aggregates_cache.clear()
+            self.generation += 1
+
+    def _select(self, since=None, until=None) -> list:
+        """Sessions with since <= timestamp < until; caller holds lock"""
+        sessions = self.sessions
+        if since is not None:
+            sessions = [record for record in sessions if record['timestamp'] >= since]
+        if until is not None:
+            sessions = [record for record in sessions if record['timestamp'] < until]
+        return sessions
+
+    def query(self, offset=0, limit=None, since=None, until=None, newest_first=False) -> dict:
+        with self.lock:
+            sessions = self._select(since, until)
+        if newest_first:
+            sessions = sessions[::-1]
+        end = None if limit is None else offset + limit
+        return {'total': len(sessions), 'offset': offset, 'limit': limit, 'sessions': sessions[offset:end]}
+
+    def aggregates(self, since=None, until=None) -> dict:
+        with self.lock:
+            cached = self.aggregates_cache.get((since, until))
+            if cached is not None:
+                return cached
+            sessions = self._select(since, until)
+            generation = self.generation
+        result = {'count': len(sessions)}
+        for name, key in (('completion_time', 'total_rtt'), ('throughput', 'throughput'), ('packet_loss_rate', 'packet_loss_rate')):
+            values = sorted(record[key] for record in sessions)
+            result[name] = {
+                'mean': sum(values) / len(values) if values else 0,
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99)
+            }
+        with self.lock:
+            if self.generation == generation:
+                if len(self.aggregates_cache) >= HISTORY_AGGREGATES_CACHE:
+                    self.aggregates_cache.clear()
+                self.aggregates_cache[(since, until)] = result
+        return result
 
 class UDPServer:
-    def __init__(self, server_ip='192.168.88.21', server_port=5409):
+    def __init__(self, server_ip='192.168.88.21', server_port=5409, cache_dir=None, stream_interval=STREAM_UPDATE_INTERVAL):
         self.server_address = (server_ip, server_port)
         self.proxy_ip = '192.168.88.111'
         self.proxy_path1 = (self.proxy_ip, 5406)
         self.proxy_path2 = (self.proxy_ip, 5408)
+        self.paths = {'path1': self.proxy_path1, 'path2': self.proxy_path2}
+        self.path_estimators = {path: PathEstimator() for path in self.paths}
+        self.scheduler = StaticTailScheduler(list(self.paths))
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.ack_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.ack_socket.bind(self.server_address)
-        self.ack_received = defaultdict(bool)
+        self.ack_thread = None
+        self.sessions = {}  # session id -> TransferSession of every run in progress
+        # Random start, so a client still holding the finished sessions of an earlier server process
+        # does not take this process's first sessions for them
+        self.next_session_id = random.randrange(SESSION_MODULO)
+        # Shared by all sessions; the condition is notified on every ACK
         self.ack_lock = threading.Lock()
+        self.ack_cond = threading.Condition(self.ack_lock)
         self.min_interval = 0.1
-        self.last_send_time = 0
-        self.total_sequences = 0
-        self.last_path1_start = 0
-        self.total_retransmissions = 0
+        self.send_mode = 'paced'  # paced: one packet per min_interval, window: sliding-window selective repeat
+        self.window_size = 64
+        self.give_up_after = 30.0  # Seconds a sequence may stay unacked before the run is failed
+        self.fec_group = 0  # Data sequences per XOR parity datagram, 0 disables FEC
+        self.redundant_tail = 0  # Last N sequences are sent on every path, first copy to arrive wins
+        self.redundant_retransmit = False  # Also send retransmissions on every path
+        self.checksum = False  # Put a CRC32 of the payload in every header
+        self.codec = DEFAULT_CODEC  # Codec name from protocol.CODECS_BY_NAME, or 'auto'
+        self.codec_profiles = {}  # (prefix, start, end) -> {codec name: profile_codec result}
+        self.link_rate = None  # Measured bytes/s of the last window-mode run
+        self.streaming = False  # Start sending while the payload is still being compressed
         self.monitor = UDPServerMonitor()
+        self.broadcaster = StatsBroadcaster(self.monitor, stream_interval)
+        self.payload_cache = PayloadCache(cache_dir=cache_dir)
         self.running = True
-        self.current_transmission = None
+        self.transmissions = []  # send_data threads started from the dashboard
         self._start_web_server()
-        self.current_session_id = None
-        self.log_file = 'static/transmission_history.json'
-        self.ensure_log_file()
-        
-    def ensure_log_file(self):
-        if not os.path.exists('static'):
-            os.makedirs('static')
-        if not os.path.exists(self.log_file):
-            with open(self.log_file, 'w') as f:
-                json.dump([], f)
+        self.history = SessionHistoryStore()
 
     def log_session(self, stats):
         try:
-            with open(self.log_file, 'r') as f:
-                history = json.load(f)
-                
             session_log = {
                 'timestamp': time.time(),
                 'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
@@ -164,35 +852,29 @@ class UDPServer:
                 'packet_loss_rate': stats['total_packet_loss_rate']
             }
             
-            history.append(session_log)
-            
-            with open(self.log_file, 'w') as f:
-                json.dump(history, f)
-                
+            self.history.append(session_log)
         except Exception as e:
             print(f"Error logging session: {e}")
 
     def clear_history(self):
         try:
-            with open(self.log_file, 'w') as f:
-                json.dump([], f)
+            self.history.clear()
             return True
         except Exception as e:
             print(f"Error clearing history: {e}")
             return False
         
     def reset_stats(self):
-        self.total_sequences = 0
-        self.last_path1_start = 0
-        self.total_retransmissions = 0
-        self.last_send_time = 0
         self.running = True
-        self.ack_received.clear()
         self.monitor.reset_stats()
         
+    def set_scheduler(self, name: str, **options):
+        if name not in SCHEDULERS:
+            raise ValueError(f"Unknown scheduler: {name}")
+        self.scheduler = SCHEDULERS[name](list(self.paths), **options)
+
     def start_new_session(self):
         self.reset_stats()
-        return self.current_session_id
 
     def _start_web_server(self):
         app = Flask(__name__, static_folder='static')
@@ -204,44 +886,94 @@ class UDPServer:
 
         @app.route('/api/stats')
         def get_stats():
-            return self.monitor.get_current_stats()
+            since = request.args.get('since', type=int)
+            if since is None:
+                return self.monitor.get_current_stats()
+            return Response(self.monitor.get_stats_since(since), mimetype='application/json')
+
+        @app.route('/api/stream')
+        def stream_stats():
+            return Response(self.broadcaster.subscribe(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
         
         @app.route('/api/transmission/toggle', methods=['POST'])
         def toggle_transmission():
-            data = request.json
+            # The dashboard's stop request has no JSON body
+            data = request.get_json(silent=True) or {}
             prefix = data.get('prefix', 'Packet')
-            batch_size = data.get('batch_size', 65515)
-            if not self.current_transmission or not self.current_transmission.is_alive():
+            batch_size = data.get('batch_size', MAX_CHUNK_SIZE)
+            mode = data.get('mode', 'paced')
+            window_size = data.get('window_size', self.window_size)
+            fec_group = data.get('fec_group', 0)
+            codec = data.get('codec', DEFAULT_CODEC)
+            # Transfers to run side by side over the same paths, each under its own session id
+            try:
+                parallel = int(data.get('parallel', 1))
+            except (ValueError, TypeError):
+                return jsonify({'status': 'error', 'error': 'parallel must be an integer'}), 400
+            parallel = max(1, min(parallel, MAX_PARALLEL_TRANSFERS))
+            self.transmissions = [thread for thread in self.transmissions if thread.is_alive()]
+            if not self.transmissions:
+                # Settings shared by every session, only changed when nothing is sending
+                self.streaming = bool(data.get('streaming', False))
+                self.redundant_tail = max(0, int(data.get('redundant_tail', 0)))
+                self.redundant_retransmit = bool(data.get('redundant_retransmit', False))
+                self.checksum = bool(data.get('checksum', False))
+                try:
+                    self.set_scheduler(data.get('scheduler', 'static'), **data.get('scheduler_options', {}))
+                except (ValueError, TypeError) as e:
+                    return jsonify({'status': 'error', 'error': str(e)}), 400
+                if codec != 'auto' and codec not in CODECS_BY_NAME:
+                    return jsonify({'status': 'error', 'error': f"Unknown codec: {codec}"}), 400
+                self.codec = codec
                 self.monitor.record_event('transmission_status',
                     current_run=0,
                     total_runs=0,
                     status='running'
                 )
                 self.start_new_session()
-                self.current_transmission = threading.Thread(
-                    target=self.send_data,
-                    args=(1, prefix, batch_size),
-                    daemon=True
-                )
-                self.current_transmission.start()
-                return jsonify({'status': 'running', 'session_id': self.current_session_id})
+                for _ in range(parallel):
+                    thread = threading.Thread(
+                        target=self.send_data,
+                        args=(1, prefix, batch_size, mode, window_size, fec_group),
+                        daemon=True
+                    )
+                    thread.start()
+                    self.transmissions.append(thread)
+                # Every run of a transfer gets its own session id when it starts, see new_session
+                return jsonify({'status': 'running', 'parallel': parallel, 'scheduler': self.scheduler.name})
             else:
                 self.monitor.record_event('transmission_status',
                     current_run=0,
                     total_runs=0,
                     status='idle'
                 )
-                self.current_transmission.stop()
-                self.reset_stats()
+                # Running send_data threads stop at their next check
+                self.running = False
+                self.monitor.reset_stats()
                 return jsonify({'status': 'idle'})
 
         @app.route('/api/history', methods=['GET'])
         def get_history():
-            try:
-                with open(self.log_file, 'r') as f:
-                    return jsonify(json.load(f))
-            except Exception as e:
-                return jsonify({'error': str(e)}), 500
+            # ?offset=&limit=&since=&until=&order=asc|desc, since/until are unix timestamps
+            offset = request.args.get('offset', 0, type=int)
+            limit = request.args.get('limit', type=int)
+            if offset < 0 or (limit is not None and limit < 0):
+                return jsonify({'error': 'offset and limit must not be negative'}), 400
+            return jsonify(self.history.query(
+                offset=offset,
+                limit=limit,
+                since=request.args.get('since', type=float),
+                until=request.args.get('until', type=float),
+                newest_first=request.args.get('order', 'asc') == 'desc'
+            ))
+
+        @app.route('/api/history/aggregates', methods=['GET'])
+        def get_history_aggregates():
+            return jsonify(self.history.aggregates(
+                since=request.args.get('since', type=float),
+                until=request.args.get('until', type=float)
+            ))
 
         @app.route('/api/history/clear', methods=['POST']) 
         def clear_history():
@@ -256,6 +988,9 @@ class UDPServer:
         flask_thread.start()
 
     def start_ack_listener(self):
+        # One listener serves every session
+        if self.ack_thread is not None:
+            return
         self.ack_thread = threading.Thread(target=self._ack_listener, daemon=True)
         self.ack_thread.start()
 
@@ -263,70 +998,332 @@ class UDPServer:
         while True:
             try:
                 ack_message, _ = self.ack_socket.recvfrom(65535)
-                ack_data = ack_message.decode("utf-8").split(":")
-                if ack_data[0] == "ACK":
-                    sequence_number = int(ack_data[1])
-                    with self.ack_lock:
-                        self.ack_received[sequence_number] = True
-                        self.monitor.record_event('packet_acked',
-                            sequence=sequence_number,
-                            timestamp=time.time(),
-                        )
+                if ack_message[0] == SACK_TYPE:
+                    session_id, cumulative, sequences = decode_sack(ack_message)
+                    session = self.sessions.get(session_id)
+                    if session is not None:
+                        # ACKs of finished sessions are late duplicates
+                        self.process_sack(session, cumulative, sequences)
             except Exception as e:
                 print(f"Error in ACK listener: {e}")
 
-    def wait_for_next_send(self):
+    def process_sack(self, session: TransferSession, cumulative: int, sequences: list):
+        """Apply a cumulative ACK and its bitmap under a single lock acquisition"""
+        with self.ack_cond:
+            now = time.time()
+            for seq in session.ack_tracker.ack_below(cumulative):
+                self._record_ack(session, seq, now)
+            for seq in sequences:
+                self._mark_acked(session, seq, now)
+            self.ack_cond.notify_all()
+
+    def _mark_acked(self, session: TransferSession, sequence_number: int, now: float):
+        """Record the first ACK of a sequence; caller holds ack_lock"""
+        if session.ack_tracker.ack(sequence_number):
+            self._record_ack(session, sequence_number, now)
+
+    def _record_ack(self, session: TransferSession, sequence_number: int, now: float):
+        sent = session.sent_info.pop(sequence_number, None)
+        if sent is not None and sent[1] is not None:
+            self.path_estimators[sent[1]].on_ack(None if sent[2] else now - sent[0], now)
+        self.monitor.record_event('packet_acked',
+            sequence=sequence_number,
+            timestamp=now,
+            session=session.session_id
+        )
+
+    def new_session(self, codec_id: int, send_mode: str, window_size: int, fec_group: int) -> TransferSession:
+        """Register a transfer under the next free 32-bit session id"""
+        with self.ack_lock:
+            while self.next_session_id in self.sessions:
+                self.next_session_id = (self.next_session_id + 1) % SESSION_MODULO
+            session = TransferSession(self.next_session_id, codec_id, send_mode, window_size, fec_group)
+            self.sessions[session.session_id] = session
+            self.next_session_id = (self.next_session_id + 1) % SESSION_MODULO
+            if len(self.sessions) == 1:
+                # Nothing else is sending, drop in-flight counts left over from earlier runs
+                for estimator in self.path_estimators.values():
+                    estimator.in_flight = 0
+        return session
+
+    def end_session(self, session: TransferSession):
+        with self.ack_lock:
+            self.sessions.pop(session.session_id, None)
+
+    def wait_for_next_send(self, session: TransferSession):
         current_time = time.time()
-        elapsed_since_last_send = current_time - self.last_send_time
+        elapsed_since_last_send = current_time - session.last_send_time
         if elapsed_since_last_send < self.min_interval:
             time.sleep(self.min_interval - elapsed_since_last_send)
 
-    def get_proxy_address(self, sequence_number: int) -> tuple:
-        if sequence_number >= self.last_path1_start:
-            return self.proxy_path1
-        return self.proxy_path2
-
-    def send_packet(self, sequence_number: int, data: bytes, is_last: bool = False):
-        self.wait_for_next_send()
-        sequence_number_bytes = sequence_number.to_bytes(4, "big")
-        packet = sequence_number_bytes + data
-        if is_last:
-            packet += b"END"
-        proxy_address = self.get_proxy_address(sequence_number)
-        self.monitor.record_event('packet_sent', 
-            sequence=sequence_number,
-            timestamp=time.time(),
-            size=len(data),
-            path='path1' if proxy_address == self.proxy_path1 else 'path2'
-        )
-        self.server_socket.sendto(packet, proxy_address)
-        self.last_send_time = time.time()
+    def get_proxy_address(self, session: TransferSession, sequence_number: int) -> tuple:
+        path = self.scheduler.select(sequence_number, session.total_sequences, self.path_estimators)
+        return self.paths[path]
+
+    def wire_total(self, session: TransferSession) -> int:
+        # A streamed payload does not know its total yet, 0 tells the client to wait for the LAST flag
+        return 0 if session.total_sequences == UNKNOWN_TOTAL else session.total_sequences
 
-    def get_unacked_sequences(self) -> set:
+    def send_packet(self, session: TransferSession, sequence_number: int, data: bytes, is_last: bool = False,
+                    redundant: bool = False, retransmit: bool = False) -> list:
+        """Send one data sequence; returns the paths it went out on"""
+        if session.send_mode == 'paced':
+            self.wait_for_next_send(session)
+        flags = (FLAG_LAST if is_last else 0) | (FLAG_RETRANSMIT if retransmit else 0)
+        packet = pack_header(session.session_id, sequence_number, session.codec_id, self.wire_total(session),
+                             data, flags, self.checksum) + data
+        if redundant:
+            paths = list(self.paths)
+        else:
+            proxy_address = self.get_proxy_address(session, sequence_number)
+            paths = ['path1' if proxy_address == self.proxy_path1 else 'path2']
         with self.ack_lock:
-            return {seq for seq in range(self.total_sequences) if not self.ack_received[seq]}
+            previous = session.sent_info.get(sequence_number)
+            if previous is not None and previous[1] is not None and not session.ack_tracker.is_acked(sequence_number):
+                # Resending an unacked sequence means the previous copy is counted as lost
+                self.path_estimators[previous[1]].on_loss(time.time())
+            retransmitted = previous is not None
+            if not retransmitted:
+                session.first_sent[sequence_number] = time.time()
+            if redundant:
+                # The ACK does not say which copy won, so redundant sends give no RTT sample
+                session.sent_info[sequence_number] = (time.time(), None, retransmitted)
+            else:
+                self.path_estimators[paths[0]].on_sent()
+                session.sent_info[sequence_number] = (time.time(), paths[0], retransmitted)
+        for path in paths:
+            self.monitor.record_event('packet_sent', 
+                sequence=sequence_number,
+                timestamp=time.time(),
+                size=len(data),
+                path=path,
+                session=session.session_id
+            )
+            self.server_socket.sendto(packet, self.paths[path])
+        session.last_send_time = time.time()
+        return paths
+
+    def is_redundant(self, session: TransferSession, seq: int, retransmit: bool) -> bool:
+        """Send on every path at once: the tail of the transfer, and retransmissions when enabled"""
+        return seq >= session.total_sequences - self.redundant_tail or (retransmit and self.redundant_retransmit)
+
+    def send_sequence(self, session: TransferSession, seq: int, compressed_data: bytes, batch_size: int,
+                      retransmit: bool = False) -> list:
+        chunk = compressed_data[seq * batch_size:(seq + 1) * batch_size]
+        is_last = (seq == session.total_sequences - 1)
+        return self.send_packet(session, seq, chunk, is_last, self.is_redundant(session, seq, retransmit), retransmit)
+
+    def build_block_parity(self, session: TransferSession, seq: int, compressed_data: bytes, batch_size: int):
+        """XOR parity of the fec_group block that seq closes, None if seq does not close a block"""
+        if (seq + 1) % session.fec_group != 0 and seq != session.total_sequences - 1:
+            return None
+        first = seq - seq % session.fec_group
+        chunks = [compressed_data[i * batch_size:(i + 1) * batch_size] for i in range(first, seq + 1)]
+        return build_parity(first, chunks, self.wire_total(session))
+
+    def send_parity(self, session: TransferSession, block_index: int, paths: list, payload: bytes):
+        """Send a block's parity on the paths of its last data sequence; the scheduler only places data,
+        so parity does not take its turns"""
+        if session.send_mode == 'paced':
+            self.wait_for_next_send(session)
+        packet = pack_header(session.session_id, block_index, session.codec_id, self.wire_total(session),
+                             payload, FLAG_PARITY, self.checksum) + payload
+        for path in paths:
+            self.monitor.record_event('parity_sent',
+                block=block_index,
+                timestamp=time.time(),
+                size=len(payload),
+                path=path,
+                session=session.session_id
+            )
+            self.server_socket.sendto(packet, self.paths[path])
+        session.last_send_time = time.time()
+
+    def send_new_sequence(self, session: TransferSession, seq: int, compressed_data: bytes, batch_size: int):
+        """First transmission of a sequence, followed by its block's parity when it closes the block"""
+        if seq >= len(session.ack_tracker):
+            # Streamed payload: the tracker grows as chunks become available
+            with self.ack_lock:
+                session.ack_tracker.extend(self.available_sequences(session))
+        paths = self.send_sequence(session, seq, compressed_data, batch_size)
+        if session.fec_group:
+            parity = self.build_block_parity(session, seq, compressed_data, batch_size)
+            if parity is not None:
+                self.send_parity(session, seq // session.fec_group, paths, parity)
+
+    def available_sequences(self, session: TransferSession) -> int:
+        return session.stream.available if session.stream is not None else session.total_sequences
+
+    def _set_stream_total(self, session: TransferSession, total: int):
+        session.total_sequences = total
+
+    def _notify_stream_progress(self):
+        with self.ack_cond:
+            self.ack_cond.notify_all()
 
-    def handle_retransmissions(self, compressed_data: bytes, batch_size: int, max_retries: int = 5, timeout: float = 0.05):
+    def retransmit_deadline(self, session: TransferSession, seq: int, timeout: float = None) -> float:
+        """When seq is due for retransmission: a fixed timeout if given, otherwise the RTO of the path
+        its latest copy went out on (the slowest path for redundant copies); caller holds ack_lock"""
+        sent = session.sent_info.get(seq)
+        if sent is None:
+            return 0.0
+        if timeout is not None:
+            return sent[0] + timeout
+        if sent[1] is None:
+            return sent[0] + max(estimator.rto() for estimator in self.path_estimators.values())
+        return sent[0] + self.path_estimators[sent[1]].rto()
+
+    def send_window(self, session: TransferSession, compressed_data: bytes, batch_size: int) -> bool:
+        """Selective-repeat sender: keep up to window_size sequences in flight, new sends
+        are clocked by ACK arrival and only sequences whose retransmission timer expires are resent"""
+        next_seq = 0
+        in_flight = {}  # sequence -> first send time
+        while self.running:
+            with self.ack_cond:
+                for seq in [seq for seq in in_flight if session.ack_tracker.is_acked(seq)]:
+                    del in_flight[seq]
+                if next_seq >= session.total_sequences and not in_flight:
+                    return True
+                now = time.time()
+                deadlines = {seq: self.retransmit_deadline(session, seq) for seq in in_flight}
+                expired = sorted(seq for seq, deadline in deadlines.items() if now >= deadline)
+                can_send = next_seq < self.available_sequences(session) and len(in_flight) < session.window_size
+                if not expired and not can_send:
+                    if in_flight:
+                        self.ack_cond.wait(max(0.0, min(deadlines.values()) - now))
+                    else:
+                        # Waiting for the compressor to emit the next chunk
+                        self.ack_cond.wait(0.05)
+                    continue
+            for seq in expired:
+                if now - in_flight[seq] > self.give_up_after:
+                    print(f"Giving up on packet {seq} after {self.give_up_after:.0f} seconds")
+                    return False
+                print(f"Retransmitting packet {seq}")
+                self.send_sequence(session, seq, compressed_data, batch_size, retransmit=True)
+                session.total_retransmissions += 1
+            while next_seq < self.available_sequences(session) and len(in_flight) < session.window_size:
+                self.send_new_sequence(session, next_seq, compressed_data, batch_size)
+                in_flight[next_seq] = time.time()
+                next_seq += 1
+        return False
+
+    def get_unacked_sequences(self, session: TransferSession) -> list:
+        """Unacked sequences in order, copied under the lock in O(unacked)"""
+        with self.ack_lock:
+            if not session.ack_tracker.unacked_count:
+                return []
+            return session.ack_tracker.unacked()
+
+    def handle_retransmissions(self, session: TransferSession, compressed_data: bytes, batch_size: int,
+                               max_retries: int = None, timeout: float = None):
+        """Resend unacked sequences as their retransmission timers expire. By default the timer is the
+        per-path RTO with exponential backoff and the run fails once a sequence has been unacked for
+        give_up_after seconds since its first send; max_retries and timeout restore a retry cap and a fixed timer"""
         retry_count = 0
-        while retry_count < max_retries:
-            unacked = self.get_unacked_sequences()
+        while max_retries is None or retry_count < max_retries:
+            unacked = self.get_unacked_sequences(session)
             if not unacked:
                 return True
-            for seq in sorted(unacked):
+            now = time.time()
+            if not self.running:
+                break
+            with self.ack_lock:
+                deadlines = [self.retransmit_deadline(session, seq, timeout) for seq in unacked]
+                oldest = min(unacked, key=lambda seq: session.first_sent.get(seq, now))
+                oldest_sent = session.first_sent.get(oldest, now)
+            if now - oldest_sent > self.give_up_after:
+                print(f"Giving up on packet {oldest} after {self.give_up_after:.0f} seconds")
+                break
+            due = [seq for seq, deadline in zip(unacked, deadlines) if now >= deadline]
+            for seq in due:
                 print(f"Retransmitting packet {seq}, attempt {retry_count + 1}")
-                chunk = compressed_data[seq * batch_size:(seq + 1) * batch_size]
-                is_last = (seq == self.total_sequences - 1)
-                self.send_packet(seq, chunk, is_last)
-                self.total_retransmissions += 1
-            time.sleep(timeout)
-            retry_count += 1
-        remaining_unacked = self.get_unacked_sequences()
+                self.send_sequence(session, seq, compressed_data, batch_size, retransmit=True)
+                session.total_retransmissions += 1
+            if due:
+                retry_count += 1
+                continue
+            with self.ack_cond:
+                self.ack_cond.wait(max(0.001, min(deadlines) - now))
+        remaining_unacked = session.ack_tracker.unacked_count
         if remaining_unacked:
-            print(f"Failed to transmit {len(remaining_unacked)} packets after {max_retries} attempts")
+            print(f"Failed to transmit {remaining_unacked} packets after {retry_count} retransmission rounds")
             return False
         return True
 
-    def send_data(self, runTimes=5, prefix='Packet', batch_size=65515):
+    def estimate_link_rate(self, batch_size: int, send_mode: str = None) -> float:
+        if (send_mode or self.send_mode) == 'paced':
+            return batch_size / self.min_interval
+        return self.link_rate or DEFAULT_LINK_RATE
+
+    def select_codec(self, prefix: str, start: int, end: int, batch_size: int, send_mode: str = None) -> str:
+        """Pick the codec minimizing estimated compress + transmit + decompress time at the current link rate.
+        Codecs are profiled once per payload on a sample; decompression cost is measured here as a
+        stand-in for the client's. A payload already in the payload cache costs no compression"""
+        key = (prefix, start, end)
+        if key not in self.codec_profiles:
+            data = generate_packet_data(start, end, prefix=prefix).encode("utf-8")
+            sample = data[:CODEC_SAMPLE_SIZE]
+            self.codec_profiles[key] = {
+                'size': len(data),
+                'codecs': {name: profile_codec(codec, sample) for name, codec in CODECS_BY_NAME.items()}
+            }
+        profile = self.codec_profiles[key]
+        size = profile['size']
+        link_rate = self.estimate_link_rate(batch_size, send_mode)
+        def estimated_time(name):
+            codec_profile = profile['codecs'][name]
+            compressed_size = codec_profile['ratio'] * size
+            cached = self.payload_key(prefix, start, end, name) in self.payload_cache
+            compress_time = 0.0 if cached else codec_profile['compress_cost'] * size
+            return compress_time + compressed_size / link_rate + codec_profile['decompress_cost'] * size
+        return min(profile['codecs'], key=estimated_time)
+
+    def payload_key(self, prefix: str, start: int, end: int, codec_name: str) -> tuple:
+        codec = CODECS_BY_NAME[codec_name]
+        return (prefix, start, end, codec.family, codec.preset)
+
+    def get_payload(self, prefix: str, start: int, end: int, codec_name: str = DEFAULT_CODEC) -> tuple:
+        """Returns (original_size, compressed_data), generated and compressed only on a cache miss"""
+        codec = CODECS_BY_NAME[codec_name]
+        def build():
+            full_data = generate_packet_data(start, end, prefix=prefix)
+            return len(full_data), codec.compress(full_data.encode("utf-8"))
+        payload = self.payload_cache.get_or_build(self.payload_key(prefix, start, end, codec_name), build)
+        self.monitor.record_event('cache_stats', **self.payload_cache.snapshot())
+        return payload
+
+    def open_stream(self, session: TransferSession, prefix: str, start: int, end: int, codec_name: str, batch_size: int):
+        """Returns (original_size, compressed_data) on a cache hit, otherwise starts session.stream and returns None"""
+        payload = self.payload_cache.get(self.payload_key(prefix, start, end, codec_name))
+        self.monitor.record_event('cache_stats', **self.payload_cache.snapshot())
+        if payload is None:
+            session.total_sequences = UNKNOWN_TOTAL
+            session.stream = CompressedStream(CODECS_BY_NAME[codec_name],
+                generate_packet_pieces(start, end, prefix=prefix), batch_size,
+                lambda total: self._set_stream_total(session, total), self._notify_stream_progress)
+        return payload
+
+    def report_compression(self, session: TransferSession, codec_name: str, original_size: int, compressed_size: int):
+        print(f"Compressed data size: {compressed_size} bytes")
+        print(f"Compression ratio: {compressed_size / original_size * 100:.2f}%")
+        print(f"Total sequences: {session.total_sequences}")
+        print("=====================================")
+        self.monitor.record_event('compression_info',
+            codec=codec_name,
+            original_size=original_size,
+            compressed_size=compressed_size, 
+            ratio=compressed_size/original_size* 100
+        )
+
+    def send_data(self, runTimes=5, prefix='Packet', batch_size=MAX_CHUNK_SIZE, mode=None, window_size=None, fec_group=None):
+        """Send the payload runTimes times, each run as its own session; safe to call from several threads at once"""
+        fec_group = self.fec_group if fec_group is None else max(0, int(fec_group))
+        mode = mode or self.send_mode
+        window_size = self.window_size if window_size is None else max(1, int(window_size))
+        if int(batch_size) > MAX_CHUNK_SIZE:
+            print(f"Batch size {batch_size} does not fit in a UDP datagram, using {MAX_CHUNK_SIZE}")
+        batch_size = max(1, min(int(batch_size), MAX_CHUNK_SIZE))
         self.start_ack_listener()
         total_rtt = 0
         total_throughput = 0
@@ -337,47 +1334,18 @@ class UDPServer:
         for run in range(runTimes):
             if self.running == False: # Stop the transmission
                 break
-            self.last_send_time = 0
-            self.total_retransmissions = 0
             start_time = time.time()
-            full_data = generate_packet_data(1, 100000, prefix=prefix)
-            if run == 0:
-                print(f"Original data size: {len(full_data)} bytes")
-            compressed_data = compress_with_lzma(full_data)
-            with self.ack_lock:
-                self.ack_received.clear()
-            self.total_sequences = (len(compressed_data) + batch_size - 1) // batch_size
-            self.last_path1_start = max(0, self.total_sequences - 5)
-            if run == 0:
-                print(f"Compressed data size: {len(compressed_data)} bytes")
-                print(f"Compression ratio: {len(compressed_data) / len(full_data) * 100:.2f}%")
-                print(f"Total sequences: {self.total_sequences}")
-                print("=====================================")
-                self.monitor.record_event('compression_info',
-                    original_size=len(full_data),
-                    compressed_size=len(compressed_data), 
-                    ratio=len(compressed_data)/len(full_data)* 100
-                )
-            print(f"\nStarting transmission {run + 1}/{runTimes}")
-            self.monitor.record_event('transmission_status',
-                current_run=run+1,
-                total_runs=runTimes,
-                status='running'
-            )
-            for seq in range(self.total_sequences):
-                chunk = compressed_data[seq * batch_size:(seq + 1) * batch_size]
-                is_last = (seq == self.total_sequences - 1)
-                self.send_packet(seq, chunk, is_last)
-            time.sleep(0.05)
-            if not self.handle_retransmissions(compressed_data, batch_size):
+            codec_name = self.select_codec(prefix, 1, 100000, batch_size, mode) if self.codec == 'auto' else self.codec
+            session = self.new_session(CODECS_BY_NAME[codec_name].codec_id, mode, window_size, fec_group)
+            try:
+                result = self.send_run(session, run, runTimes, prefix, batch_size, codec_name, start_time)
+            finally:
+                self.end_session(session)
+            if result is None:
                 print("Transmission failed")
                 continue
-            end_time = time.time()
-            total_time = end_time - start_time
-            throughput = len(compressed_data) / total_time / 1024
-            packet_loss = self.total_retransmissions
+            total_time, throughput, packet_loss, packet_loss_rate = result
             total_packet_loss += packet_loss
-            packet_loss_rate = self.total_retransmissions / self.total_sequences
             total_packet_loss_rate += packet_loss_rate
             print(f"Total time: {total_time:.2f} seconds")
             total_rtt += total_time
@@ -391,6 +1359,10 @@ class UDPServer:
                 total_packet_loss_rate=total_packet_loss_rate,
                 average_packet_loss_rate=total_packet_loss_rate/runs_completed
             )
+            self.monitor.record_event('scheduler_update',
+                name=self.scheduler.name,
+                paths={path: estimator.snapshot() for path, estimator in self.path_estimators.items()}
+            )
             self.monitor.record_event('transmission_status',
                 current_run=run,
                 total_runs=runTimes,
@@ -404,15 +1376,73 @@ class UDPServer:
             })
 
         print("\nFinal Statistics:")
-        print(f"Average RTT in {runs_completed} runs: {total_rtt / runs_completed:.2f} seconds")
-        print(f"Average Throughput in {runs_completed} runs: {total_throughput / runs_completed:.2f} KB/s")
-        print(f"Average Packet Loss Rate: {(total_packet_loss_rate / runs_completed) * 100:.2f}% packets/sequence")
+        if runs_completed:
+            print(f"Average RTT in {runs_completed} runs: {total_rtt / runs_completed:.2f} seconds")
+            print(f"Average Throughput in {runs_completed} runs: {total_throughput / runs_completed:.2f} KB/s")
+            print(f"Average Packet Loss Rate: {(total_packet_loss_rate / runs_completed) * 100:.2f}% packets/sequence")
         print(f"Total Packet Loss: {total_packet_loss} packets")
+        if not any(thread.is_alive() for thread in self.transmissions if thread is not threading.current_thread()):
+            self.monitor.record_event('transmission_status',
+                current_run=runTimes,
+                total_runs=runTimes,
+                status='idle'
+            )
+
+    def send_run(self, session: TransferSession, run: int, runTimes: int, prefix: str, batch_size: int, codec_name: str,
+                 start_time: float):
+        """One transfer of the payload under session; returns (total_time, throughput, packet_loss, packet_loss_rate),
+        or None if it failed"""
+        payload = self.open_stream(session, prefix, 1, 100000, codec_name, batch_size) if self.streaming else self.get_payload(prefix, 1, 100000, codec_name)
+        send_start = time.time()
+        if run == 0:
+            print(f"Codec: {codec_name}, session {session.session_id}")
+        if payload is not None:
+            original_size, compressed_data = payload
+            session.total_sequences = (len(compressed_data) + batch_size - 1) // batch_size
+            with self.ack_lock:
+                session.ack_tracker.extend(session.total_sequences)
+            if run == 0:
+                print(f"Original data size: {original_size} bytes")
+                self.report_compression(session, codec_name, original_size, len(compressed_data))
+        else:
+            # Streaming: chunks are read from the stream buffer while it is still growing
+            compressed_data = session.stream.data
+            print("Streaming compression, sending as chunks become available")
+        print(f"\nStarting transmission {run + 1}/{runTimes}")
         self.monitor.record_event('transmission_status',
-            current_run=runTimes,
+            current_run=run+1,
             total_runs=runTimes,
-            status='idle'
+            status='running'
         )
+        if session.send_mode == 'window':
+            if not self.send_window(session, compressed_data, batch_size):
+                return None
+        else:
+            seq = 0
+            while seq < session.total_sequences and self.running:
+                if session.stream is not None and not session.stream.wait_for(seq):
+                    break
+                self.send_new_sequence(session, seq, compressed_data, batch_size)
+                seq += 1
+        if session.stream is not None:
+            session.stream.thread.join()
+            original_size, compressed_data = session.stream.original_size, bytes(session.stream.data)
+            self.payload_cache.put(self.payload_key(prefix, 1, 100000, codec_name), (original_size, compressed_data))
+            session.stream = None
+            if run == 0:
+                print(f"Original data size: {original_size} bytes")
+                self.report_compression(session, codec_name, original_size, len(compressed_data))
+        if not self.handle_retransmissions(session, compressed_data, batch_size):
+            return None
+        end_time = time.time()
+        total_time = end_time - start_time
+        if session.send_mode == 'window':
+            rate = len(compressed_data) / max(end_time - send_start, 1e-6)
+            self.link_rate = rate if self.link_rate is None else 0.7 * self.link_rate + 0.3 * rate
+        throughput = len(compressed_data) / total_time / 1024
+        packet_loss = session.total_retransmissions
+        packet_loss_rate = session.total_retransmissions / session.total_sequences
+        return total_time, throughput, packet_loss, packet_loss_rate
 
 if __name__ == "__main__":
     # Create static folder if it doesn't exist
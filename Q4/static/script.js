@@ -1,13 +1,24 @@
 // Global state
 let isTransmitting = false;
-let currentSessionId = null;
 let updateInterval = null;
 let toggleBtn, statusText, timeline, throughputChart, packetChart;
+// Packet events received so far, /api/stats?since=<cursor> only returns the new ones
+let statsCursor = 0;
+let packetEvents = [];
+let packetEventsById = new Map();
+// Server-Sent Events push channel, polling is only the fallback when it is unavailable
+let eventSource = null;
+// Transmission status when the history was last fetched
+let lastHistoryStatus = null;
+// Sessions shown in the history table, newest first
+const HISTORY_PAGE_SIZE = 20;
+// Largest chunk that fits in one datagram, MAX_CHUNK_SIZE in protocol.py
+const MAX_CHUNK_SIZE = 65471;
 
 // Transmission Control
 async function startTransmission() {
     const prefix = document.getElementById('prefixInput').value || 'Packet';
-    const batchSize = parseInt(document.getElementById('batchSizeInput').value) || 65515;
+    const batchSize = parseInt(document.getElementById('batchSizeInput').value) || MAX_CHUNK_SIZE;
     try {
         const response = await fetch('/api/transmission/toggle', {
             method: 'POST',
@@ -25,7 +36,6 @@ async function startTransmission() {
         
         if (data.status === 'running') {
             isTransmitting = true;
-            currentSessionId = data.session_id;
             toggleBtn.textContent = 'Stop Transmission';
             toggleBtn.classList.add('active');
             startPeriodicUpdates();
@@ -53,9 +63,54 @@ async function stopTransmission() {
 
 // Data Updates
 function startPeriodicUpdates() {
+    if (eventSource) return;
     updateInterval = setInterval(fetchStats, 40);
 }
 
+// The server pages and aggregates the history, only the latest sessions are downloaded
+async function loadHistory() {
+    const [pageResponse, aggregatesResponse] = await Promise.all([
+        fetch(`/api/history?order=desc&limit=${HISTORY_PAGE_SIZE}`),
+        fetch('/api/history/aggregates')
+    ]);
+    return [await pageResponse.json(), await aggregatesResponse.json()];
+}
+
+async function fetchHistory() {
+    try {
+        updateHistory(...await loadHistory());
+    } catch (error) {
+        console.error('Error fetching history:', error);
+    }
+}
+
+// History only changes when a session ends, so it is fetched when the transmission status changes
+function refreshHistoryOnStatusChange(stats) {
+    const status = stats?.transmission?.status;
+    if (status !== lastHistoryStatus) {
+        lastHistoryStatus = status;
+        fetchHistory();
+    }
+}
+
+function connectStream() {
+    if (!window.EventSource) return false;
+    eventSource = new EventSource('/api/stream');
+    eventSource.addEventListener('stats', (event) => {
+        const stats = applyStatsDelta(JSON.parse(event.data));
+        updateUI(stats);
+        refreshHistoryOnStatusChange(stats);
+    });
+    eventSource.onerror = () => {
+        if (eventSource.readyState === EventSource.CLOSED) {
+            console.warn('Stats stream closed, falling back to polling');
+            eventSource = null;
+            if (isTransmitting) startPeriodicUpdates();
+        }
+    };
+    return true;
+}
+
 function stopPeriodicUpdates() {
     if (updateInterval) {
         clearInterval(updateInterval);
@@ -63,19 +118,46 @@ function stopPeriodicUpdates() {
     }
 }
 
+// Merge a /api/stats?since=<cursor> delta into the local packet events and return the full stats object
+function applyStatsDelta(delta) {
+    if (delta.cursor < statsCursor) {
+        // Server restarted
+        packetEvents = [];
+        packetEventsById.clear();
+    }
+    // Drop events the server evicted or that belong to a previous session
+    if (packetEvents.length && packetEvents[0].id < delta.first) {
+        packetEvents = packetEvents.filter(packet => packet.id >= delta.first);
+        packetEventsById = new Map(packetEvents.map(packet => [packet.id, packet]));
+    }
+    for (const row of delta.events) {
+        const packet = {};
+        delta.fields.forEach((field, i) => { packet[field] = row[i]; });
+        if (packetEventsById.has(packet.id)) continue;
+        if (packet.acks !== null && packetEventsById.has(packet.acks)) {
+            packetEventsById.get(packet.acks).status = 'acked';
+        }
+        packetEvents.push(packet);
+        packetEventsById.set(packet.id, packet);
+    }
+    statsCursor = delta.cursor;
+    return { ...delta.stats, packets: packetEvents };
+}
+
+async function fetchStatsDelta() {
+    const response = await fetch(`/api/stats?since=${statsCursor}`);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return applyStatsDelta(await response.json());
+}
+
 // 在 fetchStats 函數中新增歷史資料的處理
 async function fetchStats() {
     try {
-        const [statsResponse, historyResponse] = await Promise.all([
-            fetch('/api/stats'),
-            fetch('/api/history')
-        ]);
-        
-        const stats = await statsResponse.json();
-        const history = await historyResponse.json();
-        
+        const stats = await fetchStatsDelta();
         updateUI(stats);
-        updateHistory(history);
+        refreshHistoryOnStatusChange(stats);
     } catch (error) {
         console.error('Error fetching data:', error);
     }
@@ -90,11 +172,12 @@ async function fetchStats() {
 }
 
 // 修改 updateHistory 函數，增加處理空資料的情況
-function updateHistory(history) {
+// page: /api/history?order=desc response, aggregates: /api/history/aggregates response
+function updateHistory(page, aggregates) {
     const tbody = document.getElementById('sessionHistory');
     tbody.innerHTML = '';
     
-    if (!history || history.length === 0) {
+    if (!page || page.total === 0) {
         // 如果沒有資料，顯示一個空行提示並清空平均值
         const emptyRow = document.createElement('tr');
         emptyRow.innerHTML = `
@@ -109,18 +192,16 @@ function updateHistory(history) {
         return;
     }
     
-    // 計算歷史平均值
-    const totalRtt = history.reduce((sum, session) => sum + session.total_rtt, 0);
-    const averageRtt = totalRtt / history.length;
-    
-    // 更新平均 RTT 顯示
-    document.getElementById('averageRtt').innerHTML = `${averageRtt.toFixed(2)} s<br> / ${history.length} sessions`;    
+    // 歷史平均值由伺服器計算
+    if (aggregates) {
+        const averageRtt = aggregates.completion_time.mean;
+        document.getElementById('averageRtt').innerHTML = `${averageRtt.toFixed(2)} s<br> / ${aggregates.count} sessions`;
+    }
     // 原有的歷史記錄顯示邏輯
-    const reversedHistory = [...history].reverse();
-    reversedHistory.forEach((session, index) => {
+    page.sessions.forEach((session, index) => {
         const row = document.createElement('tr');
         row.innerHTML = `
-            <td>${history.length - index}</td>
+            <td>${page.total - page.offset - index}</td>
             <td>${session.date}</td>
             <td>${session.total_rtt.toFixed(2)} s</td>
             <td>${session.total_packets}</td>
@@ -477,7 +558,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     });
                     if (response.ok) {
                         // 直接更新為空列表，不需等待 fetchStats
-                        updateHistory([]);
+                        updateHistory(null);
                         alert('歷史紀錄已清除');
                     }
                 } catch (error) {
@@ -518,27 +599,20 @@ document.addEventListener('DOMContentLoaded', () => {
     // 建立初始資料載入函式
     async function loadInitialData() {
         try {
-            const [historyResponse, statsResponse] = await Promise.all([
-                fetch('/api/history'),
-                fetch('/api/stats')
+            const [history, stats] = await Promise.all([
+                loadHistory(),
+                fetchStatsDelta()
             ]);
 
-            if (historyResponse.ok) {
-                const history = await historyResponse.json();
-                updateHistory(history);
-            } else {
-                console.error('Failed to load initial history');
-            }
-            
-            if (statsResponse.ok) {
-                const stats = await statsResponse.json();
-                updateUI(stats);
-            }
+            updateHistory(...history);
+            updateUI(stats);
         } catch (error) {
             console.error('Error loading initial data:', error);
         }
     }
 
     // 呼叫初始資料載入函式
-    loadInitialData();
+    if (!connectStream()) {
+        loadInitialData();
+    }
 });
\ No newline at end of file
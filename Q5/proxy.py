@@ -1,57 +1,502 @@
 import socket
+import struct
+import ctypes
+import selectors
+import sys
+import queue
 import threading
 import time
 import random
+import heapq
+import itertools
+import bisect
+import multiprocessing
+import functools
+import json
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# 全局變數來追蹤統計數據
-stats = {
-    'last_packet_time': None,  # 最近一次收到封包的時間
-    'start_time': None,        # 開始計算的時間
-    'packet_count': 0,         # 總處理封包數量
-    'data_total': 0,           # 總傳輸的資料大小
-    'idle_logged': False,      # 是否已記錄 Idle 狀態
-    'loss_count': 0,           # 損失封包數
-    'delay_count': 0           # 延遲封包數
+# 路徑表: (記錄標籤, path_profiles.json 中的路徑名稱, 監聽位址, 轉送位址); 新增路徑只要加一列
+PATH_TABLE = (
+    ("Proxy0", "proxy0", ('192.168.88.111', 6666), ('192.168.88.12', 6677)),
+    ("Proxy1", "proxy1", ('192.168.88.111', 5678), ('192.168.88.12', 5680)),
+    ("Proxy2", "proxy2", ('192.168.88.111', 4567), ('192.168.88.12', 4576)),
+)
+# 每條路徑每次可讀時最多處理的封包數
+RECV_BATCH = 64
+# 延遲佇列上限, 超過時新的延遲封包直接丟棄
+MAX_DELAYED_PACKETS = 10000
+# 路徑設定檔: 丟包、延遲、亂序、重複與頻寬限制, seed 不為 null 時每次執行結果相同
+PROFILE_FILE = "path_profiles.json"
+# 沒有設定檔時的預設值
+DEFAULT_PROFILES = {
+    'seed': None,
+    'paths': {
+        'proxy0': {},
+        'proxy1': {'loss': {'model': 'bernoulli', 'rate': 0.1}},
+        'proxy2': {'delay': {'probability': 0.4, 'distribution': 'fixed', 'base': 0.5}},
+    },
 }
 
-def reset_stats():
-    """重置統計數據"""
-    stats['start_time'] = None
-    stats['last_packet_time'] = None
-    stats['packet_count'] = 0
-    stats['data_total'] = 0
-    stats['idle_logged'] = False
-    stats['loss_count'] = 0
-    stats['delay_count'] = 0
+# 記錄等級: DEBUG 輸出每個封包, INFO 只輸出啟動與 Idle 統計, ERROR 只輸出錯誤
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'ERROR': 40}
+LOG_LEVEL = 'INFO'
+# DEBUG 時每 N 個封包事件只記錄一筆, 1 表示全部記錄
+LOG_SAMPLE_EVERY = 1
+# 超過這個時間沒有封包即視為 Idle (秒)
+IDLE_TIMEOUT = 1.0
+
+
+# 多程序模式: 大於 1 時啟動這麼多個 worker 程序, 各自執行事件迴圈, 以 SO_REUSEPORT 綁定同樣的路徑 port.
+# 核心預設依來源位址與 port 分配封包, 同一個來源 socket (Q4 server 的 server_socket, Q5 sender 每條路徑的 socket)
+# 的封包總是交給同一個 worker, 多程序對單一路徑沒有幫助; 因此預設以 REUSEPORT_RANDOM 隨機分配.
+# 每個 worker 各有一份路徑模擬狀態, 因此頻寬限制的 rate/burst/queue_limit 與 MAX_DELAYED_PACKETS 會除以 worker 數,
+# 合計仍等於設定值. 隨機分配時同一路徑的連續封包落在不同 worker, Gilbert-Elliott 的突發丟包相關性無法保持,
+# 因此 REUSEPORT_RANDOM 下設定 gilbert_elliott 會在啟動時報錯
+WORKER_PROCESSES = 1
+# 多程序模式下以 SO_ATTACH_REUSEPORT_CBPF 讓核心隨機選擇 worker, 單一來源的封包也能分散到所有 worker.
+# 各 worker 獨立轉送, 同一條路徑的封包因此會被重新排序; False 時使用核心預設的來源雜湊 (不重新排序)
+REUSEPORT_RANDOM = True
+# Linux 4.5+ 的 socket option, Python 的 socket 模組沒有這個常數
+SO_ATTACH_REUSEPORT_CBPF = 51
+# worker 把統計數據寫入共享記憶體的間隔 (秒)
+STATS_PUBLISH_INTERVAL = 0.1
+# 指標 HTTP 端點 (Prometheus text format), 傳輸進行中也可以隨時抓取
+METRICS_ADDRESS = ('0.0.0.0', 9105)
+# 附加延遲與轉送延遲 histogram 的 bucket 上界 (秒)
+DELAY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+COUNTER_FIELDS = ('packet_count', 'data_total', 'forwarded_count', 'forwarded_bytes',
+                  'loss_count', 'delay_count', 'duplicate_count')
+
+
+class Histogram:
+    """累積 histogram, 最後一格是 +Inf; 由 PathStats 的鎖保護"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.sum = self.sum
+        histogram.count = self.count
+        return histogram
+
+
+class PathStats:
+    """單一路徑的統計數據; 計數器只增不減 (供 /metrics 使用), Idle 統計以上次輸出時的數值為基準相減.
+    更新與 snapshot 都在同一個鎖內, Idle 檢查不會和更新交錯"""
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.start_time = None        # 本段開始計算的時間
+        self.last_packet_time = None  # 最近一次收到封包的時間
+        self.packet_count = 0         # 總處理封包數量
+        self.data_total = 0           # 總傳輸的資料大小
+        self.forwarded_count = 0      # 已送出的封包數 (含延遲後送出與重複)
+        self.forwarded_bytes = 0      # 已送出的資料大小
+        self.loss_count = 0           # 損失封包數
+        self.delay_count = 0          # 延遲封包數
+        self.duplicate_count = 0      # 重複送出的封包數
+        self.delay_histogram = Histogram(DELAY_BUCKETS)      # 每份送出封包的附加延遲
+        self.latency_histogram = Histogram(LATENCY_BUCKETS)  # 收到到送出的時間
+        self.baseline = dict.fromkeys(COUNTER_FIELDS, 0)
+        self.reset_time = 0.0  # 上次 Idle 輸出的時間
+
+    def record_packet(self, size, now):
+        with self.lock:
+            if self.start_time is None or now - self.last_packet_time > IDLE_TIMEOUT:
+                self.start_time = now  # 新的一段傳輸
+            self.last_packet_time = now
+            self.packet_count += 1
+            self.data_total += size
+
+    def record_forward(self, size, latency, delay=0.0):
+        with self.lock:
+            self.forwarded_count += 1
+            self.forwarded_bytes += size
+            self.latency_histogram.observe(latency)
+            self.delay_histogram.observe(delay)
+
+    def record_loss(self):
+        with self.lock:
+            self.loss_count += 1
+
+    def record_delay(self):
+        with self.lock:
+            self.delay_count += 1
+
+    def record_duplicate(self):
+        with self.lock:
+            self.duplicate_count += 1
+
+    def dump(self):
+        """累積數值攤平成一列 float, 寫入共享記憶體用"""
+        with self.lock:
+            values = [float(getattr(self, field)) for field in COUNTER_FIELDS]
+            values += [self.start_time or 0.0, self.last_packet_time or 0.0]
+            for histogram in (self.delay_histogram, self.latency_histogram):
+                values += histogram.counts + [histogram.sum, histogram.count]
+        return values
+
+    def load(self, rows):
+        """以各 worker 的 dump 加總後的數值取代目前的累積數值"""
+        with self.lock:
+            for i, field in enumerate(COUNTER_FIELDS):
+                setattr(self, field, int(sum(row[i] for row in rows)))
+            offset = len(COUNTER_FIELDS)
+            # 只取上次 Idle 輸出之後才開始的傳輸
+            starts = [row[offset] for row in rows if row[offset] and row[offset] >= self.reset_time]
+            self.start_time = min(starts) if starts else None
+            self.last_packet_time = max(row[offset + 1] for row in rows) or None
+            offset += 2
+            for histogram in (self.delay_histogram, self.latency_histogram):
+                size = len(histogram.counts)
+                histogram.counts = [int(sum(row[offset + i] for row in rows)) for i in range(size)]
+                histogram.sum = sum(row[offset + size] for row in rows)
+                histogram.count = int(sum(row[offset + size + 1] for row in rows))
+                offset += size + 2
+
+    def totals(self):
+        """累積計數器與 histogram 的一致快照"""
+        with self.lock:
+            totals = {field: getattr(self, field) for field in COUNTER_FIELDS}
+            totals['delay_histogram'] = self.delay_histogram.copy()
+            totals['latency_histogram'] = self.latency_histogram.copy()
+        return totals
+
+    def snapshot(self, reset=False):
+        """上次 reset 之後的統計快照; reset 時以目前數值作為新的基準"""
+        with self.lock:
+            current = {field: getattr(self, field) for field in COUNTER_FIELDS}
+            snapshot = {field: current[field] - self.baseline[field] for field in COUNTER_FIELDS}
+            snapshot['start_time'] = self.start_time
+            snapshot['last_packet_time'] = self.last_packet_time
+            if reset:
+                self.baseline = current
+                self.start_time = None
+                self.reset_time = time.time()
+        return snapshot
+
+
+class SharedStats:
+    """多程序模式的統計數據: 每個 worker 在共享記憶體中有一列, 只由該 worker 寫入, 主程序讀取後加總.
+    一列的內容: 延遲佇列深度, 接著每條路徑的 PathStats.dump() 與頻寬限制 backlog"""
+    def __init__(self, path_names, workers):
+        self.path_names = list(path_names)
+        self.path_size = len(PathStats(None).dump()) + 1
+        self.row_size = 1 + len(self.path_names) * self.path_size
+        self.values = multiprocessing.RawArray('d', workers * self.row_size)
+        self.locks = [multiprocessing.Lock() for _ in range(workers)]
+
+    def publish(self, worker):
+        """在 worker 程序中呼叫"""
+        row = [float(delay_scheduler.pending())]
+        for name in self.path_names:
+            row += path_stats[name].dump()
+            row.append(path_impairments[name].backlog())
+        start = worker * self.row_size
+        with self.locks[worker]:
+            self.values[start:start + self.row_size] = row
+
+    def collect(self):
+        """在主程序中呼叫: 把各 worker 的數值載入 path_stats, 回傳 (延遲佇列深度, 各路徑的頻寬限制 backlog)"""
+        rows = []
+        for worker, lock in enumerate(self.locks):
+            start = worker * self.row_size
+            with lock:
+                rows.append(self.values[start:start + self.row_size])
+        backlog = {}
+        for i, name in enumerate(self.path_names):
+            start = 1 + i * self.path_size
+            path_rows = [row[start:start + self.path_size] for row in rows]
+            path_stats[name].load([row[:-1] for row in path_rows])
+            backlog[name] = sum(row[-1] for row in path_rows)
+        return sum(row[0] for row in rows), backlog
+
+
+class AsyncLogger:
+    """非同步記錄器: 呼叫端只把參數放進佇列, 格式化與輸出由背景執行緒批次處理;
+    低於設定等級的記錄直接返回, 不做任何格式化"""
+    def __init__(self, level=LOG_LEVEL, sample_every=LOG_SAMPLE_EVERY):
+        self.level = LOG_LEVELS[level]
+        self.sample_every = max(1, sample_every)
+        self.counter = itertools.count()
+        self.queue = queue.SimpleQueue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def packet(self, tag, message, *args, timestamp=None):
+        """每個封包的記錄 (DEBUG), 依 sample_every 取樣"""
+        if self.level > LOG_LEVELS['DEBUG']:
+            return
+        if self.sample_every > 1 and next(self.counter) % self.sample_every:
+            return
+        self.queue.put((timestamp or time.time(), tag, message, args))
+
+    def info(self, tag, message, *args):
+        if self.level <= LOG_LEVELS['INFO']:
+            self.queue.put((time.time(), tag, message, args))
+
+    def error(self, tag, message, *args):
+        self.queue.put((time.time(), tag, message, args))
+
+    def write(self, text):
+        """整段文字 (INFO), 例如 Idle 統計"""
+        if self.level <= LOG_LEVELS['INFO']:
+            self.queue.put(text)
+
+    def _format(self, record):
+        if isinstance(record, str):
+            return record
+        timestamp, tag, message, args = record
+        return format_log(timestamp, tag, message % args if args else message)
+
+    def _run(self):
+        while True:
+            lines = [self._format(self.queue.get())]
+            # 一次寫出佇列中累積的所有記錄
+            while len(lines) < 1000:
+                try:
+                    lines.append(self._format(self.queue.get_nowait()))
+                except queue.Empty:
+                    break
+            sys.stdout.write("".join(lines))
+            sys.stdout.flush()
+
+
+class DelayScheduler:
+    """延遲封包排程器: 以 heap 依釋放時間排序. 沒有自己的執行緒, 事件迴圈以最早的釋放時間作為 select 的 timeout,
+    醒來後呼叫 run_due 送出到期的封包"""
+    def __init__(self, max_pending=MAX_DELAYED_PACKETS):
+        self.heap = []  # (release time, order, data, address, socket, callback)
+        self.order = itertools.count()  # 相同釋放時間時維持先進先出
+        self.max_pending = max_pending
+
+    def schedule(self, delay, data, address, sock, callback=None):
+        """在 delay 秒後送出封包; 佇列已滿時回傳 False, 由呼叫者視為丟包"""
+        if len(self.heap) >= self.max_pending:
+            return False
+        heapq.heappush(self.heap, (time.monotonic() + delay, next(self.order), data, address, sock, callback))
+        return True
+
+    def pending(self):
+        return len(self.heap)
+
+    def timeout(self, now):
+        """距離最早到期封包的秒數; 沒有延遲封包時回傳 None, select 會一直等到有封包進來"""
+        if not self.heap:
+            return None
+        return max(0.0, self.heap[0][0] - now)
+
+    def run_due(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            _, _, data, address, sock, callback = heapq.heappop(self.heap)
+            try:
+                sock.sendto(data, address)
+                if callback is not None:
+                    callback(data)
+            except OSError as e:
+                logger.error("Delay", "Delayed send failed: %s", e)
+
+
+class PathImpairment:
+    """依設定檔模擬一條路徑: 頻寬限制 (token bucket + 有限佇列), Gilbert-Elliott 突發丟包,
+    延遲分佈與抖動, 亂序與重複封包. 每條路徑有自己的亂數產生器, 給定 seed 時結果可重現.
+    workers > 1 時這只是一個 worker 的那一份, 頻寬限制平均分給各 worker"""
+    def __init__(self, name, profile, seed=None, worker=None, workers=1):
+        self.name = name
+        self.profile = profile
+        seed = profile.get('seed', seed)
+        if seed is not None and worker is not None:
+            seed = f"{seed}:{worker}"  # 每個 worker 各自的亂數序列
+        self.rng = random.Random(None if seed is None else f"{seed}:{name}")
+
+        loss = profile.get('loss', {})
+        self.loss_model = loss.get('model', 'bernoulli')
+        if self.loss_model == 'gilbert_elliott':
+            self.p_good_to_bad = loss.get('p', 0.0)
+            self.p_bad_to_good = loss.get('r', 1.0)
+            self.loss_good = loss.get('loss_good', 0.0)
+            self.loss_bad = loss.get('loss_bad', 1.0)
+            self.bad_state = False
+        elif self.loss_model == 'bernoulli':
+            self.loss_rate = loss.get('rate', 0.0)
+        else:
+            raise ValueError(f"{name}: unknown loss model {self.loss_model}")
+
+        delay = profile.get('delay', {})
+        self.delay_distribution = delay.get('distribution', 'fixed')
+        if self.delay_distribution not in ('fixed', 'uniform', 'normal', 'exponential', 'pareto'):
+            raise ValueError(f"{name}: unknown delay distribution {self.delay_distribution}")
+        self.delay_probability = delay.get('probability', 1.0)  # 套用延遲的封包比例
+        self.delay_base = delay.get('base', 0.0)
+        self.delay_jitter = delay.get('jitter', 0.0)
+        self.pareto_alpha = delay.get('alpha', 2.0)
+
+        reorder = profile.get('reorder', {})
+        self.reorder_probability = reorder.get('probability', 0.0)
+        self.reorder_delay = reorder.get('delay', 0.01)  # 額外延遲, 讓後面的封包先到
+
+        self.duplicate_probability = profile.get('duplicate', {}).get('probability', 0.0)
+
+        rate_limit = profile.get('rate_limit')
+        self.rate = None
+        if rate_limit:
+            self.rate = rate_limit['rate'] / workers  # bytes/s
+            self.burst = rate_limit.get('burst', 65535) / workers  # bytes
+            self.queue_limit = rate_limit.get('queue_limit', 1 << 20) / workers  # 佇列中最多等待的 bytes
+            self.tokens = self.burst
+            self.last_refill = None
+
+    def describe(self):
+        parts = []
+        if self.loss_model == 'gilbert_elliott':
+            parts.append(f"Gilbert-Elliott loss p={self.p_good_to_bad} r={self.p_bad_to_good}")
+        elif self.loss_rate:
+            parts.append(f"{self.loss_rate * 100:g}% packet loss")
+        if self.delay_base or self.delay_jitter:
+            parts.append(f"{self.delay_probability * 100:g}% {self.delay_distribution} delay "
+                         f"{self.delay_base * 1000:g}±{self.delay_jitter * 1000:g} ms")
+        if self.reorder_probability:
+            parts.append(f"{self.reorder_probability * 100:g}% reorder")
+        if self.duplicate_probability:
+            parts.append(f"{self.duplicate_probability * 100:g}% duplicate")
+        if self.rate:
+            parts.append(f"{self.rate * 8 / 1e6:g} Mbit/s cap")
+        return ", ".join(parts) or "Direct forward"
+
+    def backlog(self):
+        """頻寬限制佇列中尚未送出的 bytes; 補充到目前時間後計算, 但不修改 tokens (由轉送端更新)"""
+        if self.rate is None or self.last_refill is None:
+            return 0.0
+        tokens = self.tokens + (time.monotonic() - self.last_refill) * self.rate
+        return max(0.0, -tokens)
+
+    def _shape(self, size, now):
+        """Token bucket: 回傳排隊等待的秒數, 佇列已滿時回傳 None"""
+        if self.rate is None:
+            return 0.0
+        if self.last_refill is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        # tokens 為負數時代表佇列中尚未送出的 bytes
+        if size - self.tokens > self.queue_limit:
+            return None
+        self.tokens -= size
+        return max(0.0, -self.tokens / self.rate)
+
+    def _lost(self):
+        if self.loss_model == 'gilbert_elliott':
+            if self.bad_state:
+                if self.rng.random() < self.p_bad_to_good:
+                    self.bad_state = False
+            elif self.rng.random() < self.p_good_to_bad:
+                self.bad_state = True
+            return self.rng.random() < (self.loss_bad if self.bad_state else self.loss_good)
+        return self.rng.random() < self.loss_rate
+
+    def _delay(self):
+        if self.rng.random() >= self.delay_probability:
+            return 0.0
+        base, jitter = self.delay_base, self.delay_jitter
+        if self.delay_distribution == 'uniform':
+            delay = base + self.rng.uniform(-jitter, jitter)
+        elif self.delay_distribution == 'normal':
+            delay = self.rng.gauss(base, jitter)
+        elif self.delay_distribution == 'exponential':
+            delay = base + (self.rng.expovariate(1 / jitter) if jitter else 0.0)
+        elif self.delay_distribution == 'pareto':
+            delay = base + jitter * (self.rng.paretovariate(self.pareto_alpha) - 1)
+        else:
+            delay = base
+        return max(0.0, delay)
+
+    def process(self, size, now):
+        """決定一個封包的命運: 回傳 (各份複本的延遲秒數, 丟包原因); 串列為空代表丟包"""
+        queued = self._shape(size, now)
+        if queued is None:
+            return [], "Queue full"
+        if self._lost():
+            return [], "Packet lost"
+        delay = queued + self._delay()
+        if self.rng.random() < self.reorder_probability:
+            delay += self.reorder_delay
+        delays = [delay]
+        if self.rng.random() < self.duplicate_probability:
+            delays.append(delay)
+        return delays, ""
+
+
+def load_path_profiles(worker=None):
+    """讀取路徑設定檔; 檔案不存在或讀取失敗時使用 DEFAULT_PROFILES, 檔案中沒有的路徑也沿用預設值.
+    worker 的路徑只分得 1 / WORKER_PROCESSES 的頻寬限制"""
+    config = DEFAULT_PROFILES
+    profile_file = Path(PROFILE_FILE)
+    if profile_file.exists():
+        try:
+            with open(profile_file, 'r') as f:
+                config = json.load(f)
+        except Exception as e:
+            print(f"Error loading path profiles: {e}")
+    paths = dict(DEFAULT_PROFILES['paths'], **config.get('paths', {}))
+    if WORKER_PROCESSES > 1 and REUSEPORT_RANDOM:
+        for name, profile in paths.items():
+            if profile.get('loss', {}).get('model') == 'gilbert_elliott':
+                raise ValueError(f"{name}: gilbert_elliott loss needs WORKER_PROCESSES = 1 or REUSEPORT_RANDOM = False")
+    workers = WORKER_PROCESSES if worker is not None else 1
+    return {name: PathImpairment(name, profile, config.get('seed'), worker, workers) for name, profile in paths.items()}
 
 
 def log_idle_state():
-    """記錄並輸出 Idle 狀態的統計數據"""
-    if stats['packet_count'] > 0 and stats['start_time'] is not None:
-        elapsed_time = stats['last_packet_time'] - stats['start_time']
-        loss_rate = (stats['loss_count'] / stats['packet_count']) * 100 if stats['packet_count'] > 0 else 0
-        delay_rate = (stats['delay_count'] / stats['packet_count']) * 100 if stats['packet_count'] > 0 else 0
-
-        # 段落輸出 Idle State
-        print("=" * 50)
-        print(f"[Idle State] No packets received for 1 seconds")
-        print(f"  Time: {elapsed_time:.2f} seconds")
-        print(f"  Packets: {stats['packet_count']} | Total Data: {stats['data_total']} bytes")
-        print(f"  Loss Count: {stats['loss_count']} | Loss Rate: {loss_rate:.2f}%")
-        print(f"  Delay Count: {stats['delay_count']} | Delay Rate: {delay_rate:.2f}%")
-        print("=" * 50)
-        stats['idle_logged'] = True  # 標記已記錄 Idle 狀態
-        reset_stats()  # 重置統計數據
+    """所有路徑都 Idle 時, 取出並歸零各路徑的統計數據後輸出"""
+    snapshots = {name: path.snapshot(reset=True) for name, path in path_stats.items()}
+    active = [snapshot for snapshot in snapshots.values() if snapshot['packet_count'] > 0]
+    if not active:
+        return
+    packet_count = sum(snapshot['packet_count'] for snapshot in active)
+    data_total = sum(snapshot['data_total'] for snapshot in active)
+    loss_count = sum(snapshot['loss_count'] for snapshot in active)
+    delay_count = sum(snapshot['delay_count'] for snapshot in active)
+    duplicate_count = sum(snapshot['duplicate_count'] for snapshot in active)
+    elapsed_time = max(s['last_packet_time'] for s in active) - min(s['start_time'] for s in active)
+    loss_rate = (loss_count / packet_count) * 100
+    delay_rate = (delay_count / packet_count) * 100
+
+    # 段落輸出 Idle State
+    lines = [
+        "=" * 50,
+        f"[Idle State] No packets received for {IDLE_TIMEOUT:g} seconds",
+        f"  Time: {elapsed_time:.2f} seconds",
+        f"  Packets: {packet_count} | Total Data: {data_total} bytes",
+        f"  Loss Count: {loss_count} | Loss Rate: {loss_rate:.2f}%",
+        f"  Delay Count: {delay_count} | Delay Rate: {delay_rate:.2f}%",
+        f"  Duplicate Count: {duplicate_count}",
+    ]
+    for name, snapshot in snapshots.items():
+        if snapshot['packet_count'] > 0:
+            lines.append(f"  [{name}] Packets: {snapshot['packet_count']} | Loss: {snapshot['loss_count']}"
+                         f" | Delay: {snapshot['delay_count']} | Duplicate: {snapshot['duplicate_count']}")
+    lines.append("=" * 50)
+    logger.write("\n".join(lines) + "\n")
 
 
 def check_idle_state():
-    """檢查是否進入 Idle 狀態"""
+    """檢查是否進入 Idle 狀態; 統計歸零後 packet_count 為 0, 同一段 Idle 只會輸出一次"""
     while True:
         time.sleep(0.5)  # 每0.5秒檢查一次
-        if stats['last_packet_time'] is not None:
-            time_since_last_packet = time.time() - stats['last_packet_time']
-            if time_since_last_packet > 1 and not stats['idle_logged']:
-                log_idle_state()
+        if shared_stats is not None:
+            shared_stats.collect()
+        last_times = [path.last_packet_time for path in path_stats.values() if path.last_packet_time is not None]
+        if last_times and time.time() - max(last_times) > IDLE_TIMEOUT:
+            log_idle_state()
 
 
 def format_log(time, tag, message):
@@ -63,119 +508,211 @@ def format_log(time, tag, message):
     return f"{time%100:.2f} [{tag}] {message}\n"
 
 
-def udp_proxy1_loss():
-    proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    proxy_socket.bind(('192.168.88.111', 5678))
-    client_address = ('192.168.88.12', 5680)
-    print("[Proxy1] Started - 10% packet loss")
+def on_delayed_forward(tag, stats, received, delay, data):
+    stats.record_forward(len(data), time.monotonic() - received, delay)
+    logger.packet(tag, "Forwarded after delay: %d bytes", len(data))
 
-    while True:
-        try:
-            data, _ = proxy_socket.recvfrom(65535)
-            current_time = time.time()
-
-            # 更新統計數據
-            if stats['start_time'] is None:
-                stats['start_time'] = current_time
-            stats['last_packet_time'] = current_time
-            stats['packet_count'] += 1
-            stats['data_total'] += len(data)
-            stats['idle_logged'] = False  # 清除 Idle 狀態標記
-
-            if random.random() > 0.1:  # chance to forward
-                proxy_socket.sendto(data, client_address)
-                print(format_log(current_time, "Proxy1", f"Forwarded: {len(data)} bytes"), end="")
-            else:
-                stats['loss_count'] += 1  # 增加丟包計數
-                print(format_log(current_time, "Proxy1", f"Packet lost: {len(data)} bytes"), end="")
-        except Exception as e:
-            print(format_log(time.time(), "Proxy1", f"Error: {e}"), end="")
+
+delay_scheduler = None  # 在 main 中建立
+logger = None           # 在 main 中建立
+path_impairments = {}   # 路徑名稱 -> PathImpairment, 在 main 中建立
+path_stats = {}         # 路徑名稱 -> PathStats
+shared_stats = None     # 多程序模式時在 main 中建立
+
+
+def forward_packet(tag, impairment, stats, proxy_socket, data, client_address, current_time, received):
+    """依路徑設定丟棄、延遲或重複送出一個封包; received 為收到時的 time.monotonic()"""
+    delays, reason = impairment.process(len(data), received)
+    if not delays:
+        stats.record_loss()  # 增加丟包計數
+        logger.packet(tag, "%s: %d bytes", reason, len(data), timestamp=current_time)
+        return
+    if len(delays) > 1:
+        stats.record_duplicate()
+    for delay in delays:
+        if delay <= 0:
+            proxy_socket.sendto(data, client_address)
+            stats.record_forward(len(data), time.monotonic() - received)
+            logger.packet(tag, "Forwarded: %d bytes", len(data), timestamp=current_time)
+        elif delay_scheduler.schedule(delay, data, client_address, proxy_socket,
+                                      functools.partial(on_delayed_forward, tag, stats, received, delay)):
+            stats.record_delay()  # 增加延遲計數
+            logger.packet(tag, "Packet delayed %.0f ms: %d bytes", delay * 1000, len(data), timestamp=current_time)
+        else:
+            stats.record_loss()  # 延遲佇列已滿, 視為丟包
+            logger.packet(tag, "Delay queue full, packet lost: %d bytes", len(data), timestamp=current_time)
 
 
-def delay_packet(data, client_address, proxy_socket):
-    time.sleep(0.5)  # 模擬延遲
-    proxy_socket.sendto(data, client_address)
-    print(format_log(time.time(), "Proxy2", f"Forwarded after delay: {len(data)} bytes"), end="")
+def attach_random_reuseport(proxy_socket, workers):
+    """附加 classic BPF 程式到 reuseport 群組: 回傳 隨機數 % workers, 核心把封包交給群組中的該 socket"""
+    program = [
+        (0x20, 0, 0, (-0x1000 + 56) & 0xffffffff),  # BPF_LD|BPF_W|BPF_ABS: A = SKF_AD_OFF + SKF_AD_RANDOM
+        (0x94, 0, 0, workers),                       # BPF_ALU|BPF_MOD|BPF_K: A %= workers
+        (0x16, 0, 0, 0),                             # BPF_RET|BPF_A: return A
+    ]
+    filters = ctypes.create_string_buffer(b"".join(struct.pack("HBBI", *instruction) for instruction in program))
+    # struct sock_fprog { unsigned short len; struct sock_filter *filter; }, 核心在 setsockopt 時複製程式
+    proxy_socket.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF,
+                            struct.pack("HP", len(program), ctypes.addressof(filters)))
 
 
-def udp_proxy2_delay():
-    proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    proxy_socket.bind(('192.168.88.111', 4567))
-    client_address = ('192.168.88.12', 4576)
-    print("[Proxy2] Started - 40% delay")
+def run_event_loop():
+    """單一事件迴圈服務 PATH_TABLE 中的所有路徑, 不需要每條路徑一個執行緒"""
+    selector = selectors.DefaultSelector()
+    for tag, path_name, listen_address, client_address in PATH_TABLE:
+        proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if WORKER_PROCESSES > 1:
+            proxy_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        proxy_socket.bind(listen_address)
+        if WORKER_PROCESSES > 1 and REUSEPORT_RANDOM:
+            try:
+                attach_random_reuseport(proxy_socket, WORKER_PROCESSES)
+            except OSError as e:
+                logger.error(tag, "Random worker selection unavailable, using source hashing: %s", e)
+        proxy_socket.setblocking(False)
+        impairment = path_impairments[path_name]
+        selector.register(proxy_socket, selectors.EVENT_READ,
+                          (tag, impairment, path_stats[path_name], client_address))
+        logger.info(tag, "Started - %s", impairment.describe())
 
     while True:
-        try:
-            data, _ = proxy_socket.recvfrom(65535)
-            current_time = time.time()
-
-            # 更新統計數據
-            if stats['start_time'] is None:
-                stats['start_time'] = current_time
-            stats['last_packet_time'] = current_time
-            stats['packet_count'] += 1
-            stats['data_total'] += len(data)
-            stats['idle_logged'] = False  # 清除 Idle 狀態標記
-
-            if random.random() < 0.4:  # chance of delay
-                stats['delay_count'] += 1  # 增加延遲計數
-                threading.Thread(
-                    target=delay_packet, 
-                    args=(data, client_address, proxy_socket),
-                    daemon=True  # 設為daemon線程,這樣主程式結束時會自動結束
-                ).start()
-                print(format_log(current_time, "Proxy2", f"Packet delayed: {len(data)} bytes"), end="")
-            else:
-                proxy_socket.sendto(data, client_address)
-                print(format_log(current_time, "Proxy2", f"Forwarded: {len(data)} bytes"), end="")
-        except Exception as e:
-            print(format_log(time.time(), "Proxy2", f"Error: {e}"), end="")
+        for key, _ in selector.select(delay_scheduler.timeout(time.monotonic())):
+            proxy_socket = key.fileobj
+            tag, impairment, stats, client_address = key.data
+            # 一次最多讀 RECV_BATCH 個封包, 避免單一路徑佔住迴圈
+            for _ in range(RECV_BATCH):
+                try:
+                    data, _ = proxy_socket.recvfrom(65535)
+                except BlockingIOError:
+                    break
+                except OSError as e:
+                    logger.error(tag, "Error: %s", e)
+                    break
+                try:
+                    received = time.monotonic()
+                    current_time = time.time()
+                    stats.record_packet(len(data), current_time)  # 更新統計數據
+                    forward_packet(tag, impairment, stats, proxy_socket, data, client_address, current_time, received)
+                except Exception as e:
+                    logger.error(tag, "Error: %s", e)
+        delay_scheduler.run_due(time.monotonic())
+
+
+def render_metrics():
+    """所有路徑的指標, Prometheus text format"""
+    if shared_stats is not None:
+        queue_depth, backlog = shared_stats.collect()
+    else:
+        queue_depth = delay_scheduler.pending()
+        backlog = {name: impairment.backlog() for name, impairment in path_impairments.items()}
+    totals = {name: stats.totals() for name, stats in path_stats.items()}
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for name, field, help_text in (
+        ('proxy_received_packets_total', 'packet_count', 'Datagrams received on the path'),
+        ('proxy_received_bytes_total', 'data_total', 'Bytes received on the path'),
+        ('proxy_forwarded_packets_total', 'forwarded_count', 'Datagrams sent on, including delayed and duplicated copies'),
+        ('proxy_forwarded_bytes_total', 'forwarded_bytes', 'Bytes sent on'),
+        ('proxy_dropped_packets_total', 'loss_count', 'Datagrams dropped by loss, a full rate-limit queue or a full delay queue'),
+        ('proxy_delayed_packets_total', 'delay_count', 'Datagrams handed to the delay queue'),
+        ('proxy_duplicated_packets_total', 'duplicate_count', 'Datagrams sent twice'),
+    ):
+        family(name, 'counter', help_text)
+        for path, values in totals.items():
+            lines.append(f'{name}{{path="{path}"}} {values[field]}')
+
+    family('proxy_delay_queue_depth', 'gauge', 'Datagrams waiting in the delay queue')
+    lines.append(f"proxy_delay_queue_depth {queue_depth:.0f}")
+    family('proxy_rate_limit_backlog_bytes', 'gauge', 'Bytes queued behind the rate limit of the path')
+    for path, value in backlog.items():
+        lines.append(f'proxy_rate_limit_backlog_bytes{{path="{path}"}} {value:.0f}')
+
+    for name, field, help_text in (
+        ('proxy_added_delay_seconds', 'delay_histogram', 'Delay added to each forwarded datagram'),
+        ('proxy_forward_latency_seconds', 'latency_histogram', 'Time from receiving a datagram to sending it on'),
+    ):
+        family(name, 'histogram', help_text)
+        for path, values in totals.items():
+            histogram = values[field]
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                lines.append(f'{name}_bucket{{path="{path}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{path="{path}"}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{path="{path}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
+    def log_message(self, format, *args):
+        pass  # 不輸出每次抓取的記錄
 
-def udp_proxy0_forward():
-    proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    proxy_socket.bind(('192.168.88.111', 6666))
-    client_address = ('192.168.88.12', 6677)
-    print("[Proxy0] Started - Direct forward")
 
+def serve_metrics():
+    server = ThreadingHTTPServer(METRICS_ADDRESS, MetricsHandler)
+    logger.info("Metrics", "Serving http://%s:%d/metrics", *METRICS_ADDRESS)
+    server.serve_forever()
+
+
+def publish_stats(worker, shared):
     while True:
-        try:
-            data, _ = proxy_socket.recvfrom(65535)
-            current_time = time.time()
+        time.sleep(STATS_PUBLISH_INTERVAL)
+        shared.publish(worker)
 
-            # 更新統計數據
-            if stats['start_time'] is None:
-                stats['start_time'] = current_time
-            stats['last_packet_time'] = current_time
-            stats['packet_count'] += 1
-            stats['data_total'] += len(data)
-            stats['idle_logged'] = False  # 清除 Idle 狀態標記
 
-            proxy_socket.sendto(data, client_address)
-            print(format_log(current_time, "Proxy0", f"Forwarded: {len(data)} bytes"), end="")
-        except Exception as e:
-            print(format_log(time.time(), "Proxy0", f"Error: {e}"), end="")
+def run_worker(worker, shared):
+    """多程序模式的 worker: 各自的 socket (SO_REUSEPORT)、延遲排程器與亂數序列, 統計數據定期寫入共享記憶體"""
+    global delay_scheduler, logger, path_impairments
+    logger = AsyncLogger()
+    path_impairments = load_path_profiles(worker)
+    path_stats.update((name, PathStats(name)) for name in path_impairments)
+    delay_scheduler = DelayScheduler(MAX_DELAYED_PACKETS // WORKER_PROCESSES)
+    threading.Thread(target=publish_stats, args=(worker, shared), daemon=True).start()
+    try:
+        run_event_loop()
+    except KeyboardInterrupt:
+        pass
 
 
 def main():
-    # 創建三個線程分別運行 proxy0, proxy1 和 proxy2
-    proxy0_thread = threading.Thread(target=udp_proxy0_forward, daemon=True)
-    proxy1_thread = threading.Thread(target=udp_proxy1_loss, daemon=True)
-    proxy2_thread = threading.Thread(target=udp_proxy2_delay, daemon=True)
-    idle_check_thread = threading.Thread(target=check_idle_state, daemon=True)
-    
-    # 啟動線程
-    proxy0_thread.start()
-    proxy1_thread.start()
-    proxy2_thread.start()
-    idle_check_thread.start()
-    
+    global delay_scheduler, logger, path_impairments, shared_stats
+    logger = AsyncLogger()
+    path_impairments = load_path_profiles()
+    path_stats.update((name, PathStats(name)) for name in path_impairments)
+    threading.Thread(target=check_idle_state, daemon=True).start()
+    threading.Thread(target=serve_metrics, daemon=True).start()
+
     try:
-        # 保持主程式運行
-        while True:
-            time.sleep(1)
+        if WORKER_PROCESSES > 1:
+            shared_stats = SharedStats(path_impairments, WORKER_PROCESSES)
+            for worker in range(WORKER_PROCESSES):
+                multiprocessing.Process(target=run_worker, args=(worker, shared_stats), daemon=True).start()
+            logger.info("System", "Started %d worker processes", WORKER_PROCESSES)
+            # 保持主程式運行
+            while True:
+                time.sleep(1)
+        else:
+            delay_scheduler = DelayScheduler()
+            run_event_loop()
     except KeyboardInterrupt:
         print("\n[System] Shutting down proxies...")
 
+
 if __name__ == "__main__":
     main()
\ No newline at end of file